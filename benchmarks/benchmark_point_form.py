@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import sys
+import random
+import time
+import datetime
+import string
+import json
+
+from petlib.ec import EcPt, POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED
+
+sys.path.append('./')
+sys.path.append('..')
+from mspsi.mspsi import MSPSIClient, MSPSIServer
+from mspsi.points import iter_points
+
+KEYWORD_LENGTH = 16
+
+CURVE_LIST = (415, 714, 715, 716)
+POINT_FORMS = {'compressed': POINT_CONVERSION_COMPRESSED, 'uncompressed': POINT_CONVERSION_UNCOMPRESSED}
+NUMBER_DOCS_PUBLISHED = 1000
+NUMBER_KWDS_PER_DOC = 100
+QUERY_LIST = (10, 100)
+
+
+class BenchmarkPointForm:
+    """
+    Compare the costs of queries and replies with compressed and uncompressed points.
+
+    Compressed points are smaller, uncompressed points are decoded without a modular
+    square root when the server replies and when the client decrypts the reply.
+    """
+
+    def __init__(self, data, curve, point_form, number_kwds_per_query, repetitions=10):
+        random.seed(0)
+
+        self.data = data
+
+        self.curve = curve
+        self.point_form = point_form
+        self.repetitions = repetitions
+        self.number_kwds_per_query = number_kwds_per_query
+
+        self.kwds_published = [[(''.join((random.choice(string.ascii_lowercase) for _ in range(KEYWORD_LENGTH)))) for _ in range(NUMBER_KWDS_PER_DOC)] for _ in range(NUMBER_DOCS_PUBLISHED)]
+        self.kwds_query = [[(''.join((random.choice(string.ascii_lowercase) for _ in range(KEYWORD_LENGTH)))) for _ in range(number_kwds_per_query)] for _ in range(repetitions)]
+
+        self.mspsi_client = MSPSIClient(curve, point_form=POINT_FORMS[point_form])
+        self.mspsi_server = MSPSIServer(curve)
+
+
+    def run(self):
+        (secret_server, published) = self.mspsi_server.publish(self.kwds_published)
+
+        times = []
+        lengths = []
+        queries = []
+        for kwds in self.kwds_query:
+            t0 = time.process_time()
+            query = self.mspsi_client.query(kwds, packed=True)
+            t1 = time.process_time()
+
+            times.append(t1-t0)
+            lengths.append(len(query[1]))
+            queries.append(query)
+
+        self.data['query'][self.curve][self.point_form][self.number_kwds_per_query] = {'time': times, 'length': lengths}
+
+        times = []
+        lengths = []
+        replies = []
+        for query in queries:
+            t0 = time.process_time()
+            reply = self.mspsi_server.reply(secret_server, query[1])
+            t1 = time.process_time()
+
+            times.append(t1-t0)
+            lengths.append(len(reply))
+            replies.append(reply)
+
+        self.data['reply'][self.curve][self.point_form][self.number_kwds_per_query] = {'time': times, 'length': lengths}
+
+        times = []
+        for i, reply in enumerate(replies):
+            t0 = time.process_time()
+            self.mspsi_client.compute_cardinalities(queries[i][0], reply, published)
+            t1 = time.process_time()
+
+            times.append(t1-t0)
+
+        self.data['cardinality'][self.curve][self.point_form][self.number_kwds_per_query] = {'time': times, 'length': []}
+
+        # Decoding alone, the part of the costs above which depends on the form.
+        times = []
+        for reply in replies:
+            t0 = time.process_time()
+            for pt_bytes in iter_points(reply):
+                EcPt.from_binary(pt_bytes, self.mspsi_client.group)
+            t1 = time.process_time()
+
+            times.append(t1-t0)
+
+        self.data['decode'][self.curve][self.point_form][self.number_kwds_per_query] = {'time': times, 'length': []}
+
+
+def write_data(filename, data):
+    structure = {}
+    for op in data.keys():
+        elem = []
+        for c in data[op].keys():
+            for f in data[op][c].keys():
+                for q in data[op][c][f].keys():
+                    times = {
+                        'curve': c,
+                        'point_form': f,
+                        'n_kwd_per_query': q,
+                        'times' : data[op][c][f][q]['time'],
+                        'lengths' : data[op][c][f][q]['length']
+                    }
+                    elem.append(times)
+        structure[op] = elem
+
+    content = json.dumps(structure)
+
+    with open(filename, 'w') as fd:
+        fd.write(content)
+
+
+if __name__ == '__main__':
+    data = {'query': {}, 'reply': {}, 'cardinality': {}, 'decode': {}}
+
+    for curve in CURVE_LIST:
+        for op in data.keys():
+            data[op][curve] = {point_form: {} for point_form in POINT_FORMS}
+
+    for curve in CURVE_LIST:
+        for point_form in POINT_FORMS:
+            print("Benchmarking curve = {}, point form = {}".format(curve, point_form))
+            for n_kwds_per_query in QUERY_LIST:
+                BenchmarkPointForm(data, curve, point_form, n_kwds_per_query).run()
+
+    date = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%s')
+    write_data('benchmark-point-form-{}.json'.format(date), data)
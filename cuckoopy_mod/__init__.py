@@ -1,4 +1,8 @@
 from .cuckoofilter import CuckooFilter  # noqa: F401
+from .compactfilter import CompactCuckooFilter, HighLoadCuckooFilter  # noqa: F401
+from .scalablefilter import ScalableCuckooFilter  # noqa: F401
+from .semisort import SemiSortedTable, semi_sorted_filter  # noqa: F401
+from .xorfilter import XorFilter  # noqa: F401
 
 __author__ = 'Rajath Agasthya'
 __version__ = '0.1.1'
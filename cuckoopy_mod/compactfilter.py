@@ -0,0 +1,327 @@
+"""
+Compact Cuckoo Filter
+
+Stores every fingerprint of the filter in a single contiguous table of
+fixed-width unsigned integers instead of one Bucket object per slot.
+"""
+
+import random
+
+import numpy as np
+
+from . import hashutils
+from .cuckoofilter import CuckooFilter, CuckooFilterFullException
+
+
+# Value marking an empty slot in the table.
+EMPTY = 0
+# Spreads the fingerprints over the buckets for the alternate index.
+FINGERPRINT_MULTIPLIER = 0x5bd1e995
+
+_MASK64 = (1 << 64) - 1
+
+
+def _ranks(keys):
+    # Position of each element of a sorted array among its equal elements.
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    return np.arange(len(keys)) - np.repeat(starts, counts)
+
+
+def fingerprint_dtype(fingerprint_size):
+    """
+    Get the smallest unsigned integer type able to hold a fingerprint.
+
+    :param fingerprint_size: Fingerprint size in bytes
+    :return: numpy dtype for the fingerprints
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if fingerprint_size <= np.dtype(dtype).itemsize:
+            return np.dtype(dtype)
+    raise ValueError('Fingerprints larger than 8 bytes are not supported.')
+
+
+class CompactCuckooFilter(CuckooFilter):
+    """
+    Cuckoo Filter backed by a contiguous table.
+
+    The table has shape (capacity, bucket_size) and holds EMPTY in unused
+    slots. A fingerprint equal to EMPTY is stored as 1 instead.
+    """
+
+    def __init__(self, capacity, bucket_size=4, fingerprint_size=1,
+                 max_displacements=500):
+        """
+        Initialize CompactCuckooFilter object.
+
+        :param capacity: Size of the Cuckoo Filter
+        :param bucket_size: Number of entries in a bucket
+        :param fingerprint_size: Fingerprint size in bytes
+        :param max_displacements: Maximum number of evictions before filter is
+        considered full
+        """
+        self.capacity = capacity
+        self.bucket_size = bucket_size
+        self.fingerprint_size = fingerprint_size
+        self.max_displacements = max_displacements
+        self.table = np.zeros((capacity, bucket_size),
+                              dtype=fingerprint_dtype(fingerprint_size))
+        self.size = 0
+
+    @classmethod
+    def from_table(cls, table, fingerprint_size, size=None,
+                   max_displacements=500):
+        """
+        Build a CompactCuckooFilter around an existing table.
+
+        The table is used as is, without copy, so it may be a read-only or
+        memory-mapped array.
+
+        :param table: Array of shape (capacity, bucket_size) holding the
+        fingerprints
+        :param fingerprint_size: Fingerprint size in bytes
+        :param size: Number of items in the table, counted if not given
+        :param max_displacements: Maximum number of evictions before filter is
+        considered full
+        :return: the filter
+        """
+        cf = cls.__new__(cls)
+        cf.capacity, cf.bucket_size = table.shape
+        cf.fingerprint_size = fingerprint_size
+        cf.max_displacements = max_displacements
+        cf.table = table
+        cf.size = int(np.count_nonzero(table)) if size is None else size
+        return cf
+
+    @classmethod
+    def from_filter(cls, cf):
+        """
+        Build a CompactCuckooFilter holding the same fingerprints as a
+        list-based CuckooFilter.
+
+        :param cf: CuckooFilter to convert
+        :return: the filter
+        """
+        table = np.zeros((cf.capacity, cf.bucket_size),
+                         dtype=fingerprint_dtype(cf.fingerprint_size))
+        for index, b in enumerate(cf.buckets):
+            table[index, :len(b)] = [f or 1 for f in b.bucket]
+        return cls.from_table(table, cf.fingerprint_size, size=cf.size,
+                              max_displacements=cf.max_displacements)
+
+    def __repr__(self):
+        return '<CompactCuckooFilter: capacity=' + str(self.capacity) + \
+               ', size=' + str(self.size) + ', fingerprint size=' + \
+               str(self.fingerprint_size) + ' byte(s)>'
+
+    def _get_fingerprint(self, item):
+        fingerprint = hashutils.fingerprint(item, self.fingerprint_size)
+        if fingerprint == EMPTY:
+            fingerprint = 1
+        return fingerprint
+
+    def _get_fingerprints(self, data):
+        fingerprints = hashutils.fingerprints(data, self.fingerprint_size)
+        fingerprints[fingerprints == EMPTY] = 1
+        return fingerprints
+
+    def _bucket_contains(self, index, fingerprint):
+        # Lists are much faster than numpy on a handful of elements.
+        return fingerprint in self.table[index].tolist()
+
+    def _bucket_replace(self, index, old, new):
+        try:
+            slot = self.table[index].tolist().index(old)
+        except ValueError:
+            return False
+        self.table[index, slot] = new
+        return True
+
+    def _bucket_insert(self, index, fingerprint):
+        return self._bucket_replace(index, EMPTY, fingerprint)
+
+    def _bucket_delete(self, index, fingerprint):
+        return self._bucket_replace(index, fingerprint, EMPTY)
+
+    def _insert_fingerprint(self, fingerprint, i, j):
+        if self._bucket_insert(i, fingerprint) \
+                or self._bucket_insert(j, fingerprint):
+            self.size += 1
+            return True
+
+        # Evictions are recorded so the table can be restored on failure.
+        evictions = []
+        eviction_index = random.choice([i, j])
+        for _ in range(self.max_displacements):
+            slot = random.randrange(self.bucket_size)
+            evicted = int(self.table[eviction_index, slot])
+            self.table[eviction_index, slot] = fingerprint
+            evictions.append((eviction_index, slot, evicted))
+            fingerprint = evicted
+            eviction_index = self._get_alternate_index(eviction_index,
+                                                       fingerprint)
+            if self._bucket_insert(eviction_index, fingerprint):
+                self.size += 1
+                return True
+
+        for index, slot, evicted in reversed(evictions):
+            self.table[index, slot] = evicted
+        return False
+
+    def insert(self, item):
+        """
+        Insert an item into the filter.
+
+        The filter is left unchanged when the insertion fails.
+
+        :param item: Item to be inserted.
+        :return: True if insert is successful; CuckooFilterFullException if
+        filter is full.
+        """
+        fingerprint = self._get_fingerprint(item)
+        i = self._get_index(item)
+        j = self._get_alternate_index(i, fingerprint)
+
+        if self._insert_fingerprint(fingerprint, i, j):
+            return True
+        # Filter is full
+        raise CuckooFilterFullException('Insert operation failed. '
+                                        'Filter is full.')
+
+    def insert_many(self, items, item_size=None, evict=True):
+        """
+        Insert many items into the filter.
+
+        The buckets of every item are computed first. The items are placed in
+        the order of their primary bucket into the free entries of their
+        primary buckets, then of their alternate buckets, a whole array at a
+        time, and only the remaining ones go through evictions. An item which
+        cannot be inserted does not stop the insertion of the following ones.
+
+        The alternate index of this class is not involutive: an evicted
+        fingerprint may be moved to a bucket which is not probed for its
+        item, which is then reported inserted but not found. from_digests()
+        detects these false negatives, HighLoadCuckooFilter avoids them.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :param evict: Whether the items finding no free entry in their buckets
+        go through evictions, or are left out.
+        :return: numpy array of booleans, True where the item was inserted;
+        CuckooFilterFullException, before inserting anything, if the filter
+        has fewer free entries than items.
+        """
+        data = hashutils.as_array(items, item_size)
+        self._check_free(len(data))
+        fingerprints, i, j = self._probe_many(data)
+        fingerprints = fingerprints.astype(self.table.dtype)
+
+        # Free slots of each bucket, first in each row of slots.
+        slots = np.argsort(self.table != EMPTY, axis=1, kind='stable')
+        free = self.bucket_size - np.count_nonzero(self.table, axis=1)
+        used = np.zeros(self.capacity, dtype=np.int64)
+
+        inserted = np.zeros(len(data), dtype=bool)
+        for indices in (i.astype(np.int64), j.astype(np.int64)):
+            pending = np.flatnonzero(~inserted)
+            pending = pending[np.argsort(indices[pending], kind='stable')]
+            buckets = indices[pending]
+            ranks = _ranks(buckets) + used[buckets]
+            placed = ranks < free[buckets]
+            pending, buckets = pending[placed], buckets[placed]
+            self.table[buckets, slots[buckets, ranks[placed]]] = \
+                fingerprints[pending]
+            used += np.bincount(buckets, minlength=self.capacity)
+            inserted[pending] = True
+        self.size += int(np.count_nonzero(inserted))
+
+        if not evict:
+            return inserted
+
+        for k in np.flatnonzero(~inserted).tolist():
+            inserted[k] = self._insert_fingerprint(int(fingerprints[k]),
+                                                   int(i[k]), int(j[k]))
+
+        return inserted
+
+    def contains(self, item):
+        """
+        Check if the filter contains the item.
+
+        :param item: Item to check its presence in the filter.
+        :return: True, if item is in the filter; False, otherwise.
+        """
+        fingerprint = self._get_fingerprint(item)
+        i = self._get_index(item)
+        j = self._get_alternate_index(i, fingerprint)
+
+        return self._bucket_contains(i, fingerprint) \
+            or self._bucket_contains(j, fingerprint)
+
+    def contains_many(self, items, item_size=None):
+        """
+        Check if the filter contains each of many items.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :return: numpy array of booleans, True where the item is in the
+        filter.
+        """
+        data = hashutils.as_array(items, item_size)
+        fingerprints, i, j = self._probe_many(data)
+        fingerprints = fingerprints.astype(self.table.dtype)[:, None]
+        return (self.table[i] == fingerprints).any(axis=1) \
+            | (self.table[j] == fingerprints).any(axis=1)
+
+    def delete(self, item):
+        """
+        Delete an item from the filter.
+
+        To delete an item safely, it must have been previously inserted.
+        Otherwise, deleting a non-inserted item might unintentionally remove
+        a real, different item that happens to share the same fingerprint.
+
+        :param item: Item to delete from the filter.
+        :return: True, if item is found and deleted; False, otherwise.
+        """
+        fingerprint = self._get_fingerprint(item)
+        i = self._get_index(item)
+        j = self._get_alternate_index(i, fingerprint)
+        if self._bucket_delete(i, fingerprint) \
+                or self._bucket_delete(j, fingerprint):
+            self.size -= 1
+            return True
+        return False
+
+
+class HighLoadCuckooFilter(CompactCuckooFilter):
+    """
+    Compact Cuckoo Filter with an involutive alternate index.
+
+    The alternate index of a bucket is (hash(fingerprint) - index) modulo the
+    capacity, so the alternate of the alternate index is always the original
+    index, whatever the capacity. Evicted fingerprints therefore always stay
+    in one of the two buckets probed for them, and the filter can be filled
+    up to MAX_LOAD_FACTOR.
+    """
+
+    MAX_LOAD_FACTOR = 0.9
+    INVOLUTIVE = True
+
+    def __repr__(self):
+        return '<HighLoadCuckooFilter: capacity=' + str(self.capacity) + \
+               ', size=' + str(self.size) + ', fingerprint size=' + \
+               str(self.fingerprint_size) + ' byte(s)>'
+
+    def _get_alternate_index(self, index, fingerprint):
+        h = (fingerprint * FINGERPRINT_MULTIPLIER) & _MASK64
+        return (h - index) % self.capacity
+
+    def _get_alternate_indices(self, indices, fingerprints):
+        capacity = np.uint64(self.capacity)
+        h = (fingerprints * np.uint64(FINGERPRINT_MULTIPLIER)) % capacity
+        return (h + capacity - indices) % capacity
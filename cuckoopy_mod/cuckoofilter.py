@@ -2,8 +2,11 @@
 Cuckoo Filter
 """
 
+import math
 import random
 
+import numpy as np
+
 from . import bucket
 from . import hashutils
 
@@ -21,6 +24,12 @@ class CuckooFilter(object):
     Implements insert, delete and contains operations for the filter.
     """
 
+    # Load factor up to which insertions are expected to succeed.
+    MAX_LOAD_FACTOR = 0.5
+    # Whether the alternate of the alternate index of a bucket is always the
+    # bucket itself, so that evictions keep every item in its two buckets.
+    INVOLUTIVE = False
+
     def __init__(self, capacity, bucket_size=4, fingerprint_size=1,
                  max_displacements=500):
         """
@@ -40,6 +49,58 @@ class CuckooFilter(object):
                         for _ in range(self.capacity)]
         self.size = 0
 
+    @classmethod
+    def from_digests(cls, digests, capacity, bucket_size=4,
+                     fingerprint_size=1, max_displacements=500,
+                     item_size=None):
+        """
+        Build a filter containing the given items, inserted in bulk with
+        insert_many().
+
+        Unless the alternate index is involutive, as in HighLoadCuckooFilter,
+        evictions may move a fingerprint to a bucket never probed for its
+        item, so the items are looked up once inserted and those not found
+        count as failed insertions.
+
+        :param digests: Iterable of items of the same size, or a contiguous
+        buffer of concatenated items
+        :param capacity: Size of the Cuckoo Filter
+        :param bucket_size: Number of entries in a bucket
+        :param fingerprint_size: Fingerprint size in bytes
+        :param max_displacements: Maximum number of evictions before filter is
+        considered full
+        :param item_size: Size in bytes of an item, required for a buffer
+        :return: the filter; CuckooFilterFullException, once every item was
+        tried, if some of them could not be inserted.
+        """
+        # Iterators are read once, for both the insertion and the check.
+        data = hashutils.as_array(digests, item_size)
+        cf = cls(capacity, bucket_size, fingerprint_size, max_displacements)
+        inserted = cf.insert_many(data, data.shape[1])
+        inserted &= cf.contains_many(data, data.shape[1])
+        n_failed = len(inserted) - int(np.count_nonzero(inserted))
+        if n_failed:
+            raise CuckooFilterFullException(
+                str(n_failed) + ' of ' + str(len(inserted)) +
+                ' items could not be inserted. Filter is full.')
+        return cf
+
+    @classmethod
+    def capacity_for(cls, n_items, bucket_size=4):
+        """
+        Get the smallest capacity holding a number of items at the maximal
+        load factor.
+
+        :param n_items: Number of items to be inserted in the filter
+        :param bucket_size: Number of entries in a bucket
+        :return: capacity of the filter
+        """
+        return max(1, math.ceil(n_items / (bucket_size * cls.MAX_LOAD_FACTOR)))
+
+    @property
+    def load_factor(self):
+        return self.size / (self.capacity * self.bucket_size)
+
     def __repr__(self):
         return '<CuckooFilter: capacity=' + str(self.capacity) + \
                ', size=' + str(self.size) + ', fingerprint size=' + \
@@ -59,6 +120,33 @@ class CuckooFilter(object):
         alt_index = (index ^ abs(hash(fingerprint))) % self.capacity
         return alt_index
 
+    def _get_fingerprints(self, data):
+        return hashutils.fingerprints(data, self.fingerprint_size)
+
+    def _get_indices(self, data):
+        return hashutils.hash_codes(data) % np.uint64(self.capacity)
+
+    def _get_alternate_indices(self, indices, fingerprints):
+        if self.fingerprint_size < 8:
+            # hash() is the identity on integers below 2**61 - 1.
+            hashes = fingerprints
+        else:
+            hashes = np.fromiter((abs(hash(int(f))) for f in fingerprints),
+                                 dtype=np.uint64, count=len(fingerprints))
+        return (indices ^ hashes) % np.uint64(self.capacity)
+
+    def _probe_many(self, data):
+        """
+        Compute the fingerprints and both bucket indices of many items.
+
+        :param data: Items as returned by hashutils.as_array()
+        :return: arrays of fingerprints, indices and alternate indices
+        """
+        fingerprints = self._get_fingerprints(data)
+        i = self._get_indices(data)
+        j = self._get_alternate_indices(i, fingerprints)
+        return fingerprints, i, j
+
     def insert(self, item):
         """
         Insert an item into the filter.
@@ -87,6 +175,55 @@ class CuckooFilter(object):
         raise CuckooFilterFullException('Insert operation failed. '
                                                    'Filter is full.')
 
+    def _check_free(self, n_items):
+        n_free = self.capacity * self.bucket_size - self.size
+        if n_items > n_free:
+            raise CuckooFilterFullException(
+                'Cannot insert ' + str(n_items) + ' items, the filter has ' +
+                str(n_free) + ' free entries.')
+
+    def insert_many(self, items, item_size=None, evict=True):
+        """
+        Insert many items into the filter.
+
+        The buckets of every item are computed first. The items are placed in
+        the order of their primary bucket into the first of their buckets
+        having a free entry, and only the remaining ones go through evictions.
+        An item which cannot be inserted does not stop the insertion of the
+        following ones.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :param evict: Whether the items finding no free entry in their buckets
+        go through evictions, or are left out.
+        :return: numpy array of booleans, True where the item was inserted;
+        CuckooFilterFullException, before inserting anything, if the filter
+        has fewer free entries than items.
+        """
+        data = hashutils.as_array(items, item_size)
+        self._check_free(len(data))
+        fingerprints, i, j = self._probe_many(data)
+
+        inserted = np.zeros(len(data), dtype=bool)
+        for k in np.argsort(i, kind='stable').tolist():
+            fingerprint = int(fingerprints[k])
+            if self.buckets[int(i[k])].insert(fingerprint) \
+                    or self.buckets[int(j[k])].insert(fingerprint):
+                self.size += 1
+                inserted[k] = True
+
+        if not evict:
+            return inserted
+
+        for k in np.flatnonzero(~inserted).tolist():
+            try:
+                inserted[k] = self.insert(data[k].tobytes())
+            except CuckooFilterFullException:
+                pass
+
+        return inserted
+
     def contains(self, item):
         """
         Check if the filter contains the item.
@@ -100,6 +237,24 @@ class CuckooFilter(object):
 
         return fingerprint in self.buckets[i] or fingerprint in self.buckets[j]
 
+    def contains_many(self, items, item_size=None):
+        """
+        Check if the filter contains each of many items.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :return: numpy array of booleans, True where the item is in the
+        filter.
+        """
+        data = hashutils.as_array(items, item_size)
+        fingerprints, i, j = self._probe_many(data)
+        return np.fromiter(
+            (f in self.buckets[a] or f in self.buckets[b]
+             for f, a, b in zip(fingerprints.tolist(), i.tolist(),
+                                j.tolist())),
+            dtype=bool, count=len(fingerprints))
+
     def delete(self, item):
         """
         Delete an item from the filter.
@@ -4,8 +4,11 @@ Hash utilities for cuckoo filters to generate fingerprints.
 Generate FNV64 hash based on http://isthe.com/chongo/tech/comp/fnv/
 """
 
+import numpy as np
+
 
 HASH_CODE_OFFSET = 8
+HASH_CODE_SIZE = 4
 
 
 def _int_to_bytes(x):
@@ -28,9 +31,63 @@ def fingerprint(data, size):
     return _bytes_to_int(data[:size])
 
 
-def hash_code(data):
+def hash_code(data, size=HASH_CODE_SIZE):
     """Generate hash code using builtin hash() function.
 
     :param data: Data to generate hash code for
+    :param size: Size in bytes of the hash code
+    """
+    return _bytes_to_int(data[HASH_CODE_OFFSET:HASH_CODE_OFFSET+size])
+
+
+def as_array(items, item_size=None):
+    """
+    Arrange many fixed-size items as the rows of a 2D array of bytes.
+
+    :param items: Iterable of items, such as a list or a generator, or a
+    contiguous buffer of concatenated items, such as bytes or a numpy array
+    :param item_size: Size in bytes of an item, required for a buffer
+    :return: numpy array of shape (number of items, item size)
+    """
+    if not isinstance(items, (bytes, bytearray, memoryview, np.ndarray)):
+        try:
+            items = list(items)
+        except TypeError:
+            raise TypeError('Items must be an iterable of bytes, or a bytes, '
+                            'bytearray, memoryview or numpy array buffer.')
+    if isinstance(items, list):
+        item_size = len(items[0]) if items else item_size or 1
+        items = b''.join(items)
+    if item_size is None:
+        raise ValueError('The item size is required for a buffer of items.')
+    data = np.frombuffer(items, dtype=np.uint8)
+    return data.reshape(-1, item_size)
+
+
+def _columns_to_int(columns):
+    values = np.zeros(columns.shape[0], dtype=np.uint64)
+    for k in range(columns.shape[1]):
+        values = (values << np.uint64(8)) | columns[:, k]
+    return values
+
+
+def fingerprints(data, size):
+    """
+    Vectorized version of fingerprint().
+
+    :param data: Items as returned by as_array()
+    :param size: Size in bytes to truncate the fingerprints
+    :return: numpy array of fingerprints
+    """
+    return _columns_to_int(data[:, :size])
+
+
+def hash_codes(data, size=HASH_CODE_SIZE):
+    """
+    Vectorized version of hash_code().
+
+    :param data: Items as returned by as_array()
+    :param size: Size in bytes of the hash codes
+    :return: numpy array of hash codes
     """
-    return _bytes_to_int(data[HASH_CODE_OFFSET:HASH_CODE_OFFSET+4])
+    return _columns_to_int(data[:, HASH_CODE_OFFSET:HASH_CODE_OFFSET+size])
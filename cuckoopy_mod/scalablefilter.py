@@ -0,0 +1,200 @@
+"""
+Scalable Cuckoo Filter
+
+Chain of cuckoo filters growing as items are inserted: when the last filter of
+the chain is full, a larger filter is appended and receives the following
+items. Lookups probe every filter of the chain.
+"""
+
+import numpy as np
+
+from . import hashutils
+from .compactfilter import HighLoadCuckooFilter
+
+
+GROWTH_FACTOR = 2
+
+
+class ScalableCuckooFilter(object):
+    """
+    Scalable Cuckoo Filter class.
+
+    Implements insert, delete and contains operations like CuckooFilter, but
+    insertions never fail: the number of filters added to the chain is
+    counted in resizes.
+    """
+
+    def __init__(self, capacity, bucket_size=4, fingerprint_size=1,
+                 max_displacements=500, filter_cls=HighLoadCuckooFilter,
+                 growth_factor=GROWTH_FACTOR):
+        """
+        Initialize ScalableCuckooFilter object with a single filter.
+
+        :param capacity: Size of the first Cuckoo Filter
+        :param bucket_size: Number of entries in a bucket
+        :param fingerprint_size: Fingerprint size in bytes
+        :param max_displacements: Maximum number of evictions before a filter
+        is considered full
+        :param filter_cls: Class of the filters of the chain, which should
+        have an involutive alternate index to be filled up to their maximal
+        load factor
+        :param growth_factor: Ratio between the capacities of a filter and of
+        the previous one
+        """
+        self.filters = [filter_cls(capacity, bucket_size, fingerprint_size,
+                                   max_displacements)]
+        self.filter_cls = filter_cls
+        self.growth_factor = growth_factor
+
+    @classmethod
+    def from_filters(cls, filters, growth_factor=GROWTH_FACTOR,
+                     filter_cls=None):
+        """
+        Build a ScalableCuckooFilter around existing filters.
+
+        :param filters: Filters of the chain, the last one receiving the
+        insertions
+        :param growth_factor: Ratio between the capacities of a filter and of
+        the previous one
+        :param filter_cls: Class of the filters added to the chain, the class
+        of the last filter if None
+        :return: the filter
+        """
+        sf = cls.__new__(cls)
+        sf.filters = list(filters)
+        sf.filter_cls = filter_cls or type(sf.filters[-1])
+        sf.growth_factor = growth_factor
+        return sf
+
+    def __repr__(self):
+        return '<ScalableCuckooFilter: capacity=' + str(self.capacity) + \
+               ', size=' + str(self.size) + ', fingerprint size=' + \
+               str(self.fingerprint_size) + ' byte(s), resizes=' + \
+               str(self.resizes) + '>'
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return self.contains(item)
+
+    @property
+    def capacity(self):
+        return sum(f.capacity for f in self.filters)
+
+    @property
+    def bucket_size(self):
+        return self.filters[-1].bucket_size
+
+    @property
+    def fingerprint_size(self):
+        return self.filters[-1].fingerprint_size
+
+    @property
+    def size(self):
+        return sum(f.size for f in self.filters)
+
+    @property
+    def resizes(self):
+        return len(self.filters) - 1
+
+    @property
+    def slots(self):
+        # The filters of a chain may have different bucket sizes.
+        return sum(f.capacity * f.bucket_size for f in self.filters)
+
+    @property
+    def load_factor(self):
+        return self.size / self.slots
+
+    def _grow(self, n_items=0):
+        last = self.filters[-1]
+        capacity = last.capacity * self.growth_factor
+        while capacity < self.filter_cls.capacity_for(n_items,
+                                                      last.bucket_size):
+            capacity *= self.growth_factor
+        self.filters.append(self.filter_cls(capacity, last.bucket_size,
+                                            last.fingerprint_size,
+                                            last.max_displacements))
+
+    def insert(self, item):
+        """
+        Insert an item into the filter, growing it if needed.
+
+        :param item: Item to be inserted.
+        :return: True
+        """
+        return bool(self.insert_many([item])[0])
+
+    def insert_many(self, items, item_size=None):
+        """
+        Insert many items into the filter, growing it if needed.
+
+        The items are inserted in bulk into the last filter up to its maximal
+        load factor, and the items it cannot hold go to a new filter large
+        enough for them. Evictions in a filter whose alternate index is not
+        involutive may move the fingerprints of previous items out of their
+        buckets, so such filters only receive items in the free entries of
+        their buckets.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :return: numpy array of booleans, all True.
+        """
+        data = hashutils.as_array(items, item_size)
+        pending = np.arange(len(data))
+
+        while len(pending):
+            last = self.filters[-1]
+            n_free = max(0, int(last.capacity * last.bucket_size
+                                * last.MAX_LOAD_FACTOR) - last.size)
+            batch, rest = pending[:n_free], pending[n_free:]
+            if len(batch):
+                inserted = last.insert_many(data[batch],
+                                            item_size=data.shape[1],
+                                            evict=last.INVOLUTIVE)
+                pending = np.concatenate((batch[~inserted], rest))
+            if len(pending):
+                self._grow(len(pending))
+
+        return np.ones(len(data), dtype=bool)
+
+    def contains(self, item):
+        """
+        Check if the filter contains the item.
+
+        :param item: Item to check its presence in the filter.
+        :return: True, if item is in the filter; False, otherwise.
+        """
+        return any(f.contains(item) for f in self.filters)
+
+    def contains_many(self, items, item_size=None):
+        """
+        Check if the filter contains each of many items.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :return: numpy array of booleans, True where the item is in the
+        filter.
+        """
+        data = hashutils.as_array(items, item_size)
+        found = np.zeros(len(data), dtype=bool)
+        for f in self.filters:
+            found |= f.contains_many(data, item_size=data.shape[1])
+        return found
+
+    def delete(self, item):
+        """
+        Delete an item from the filter.
+
+        To delete an item safely, it must have been previously inserted.
+        Static filters heading the chain, such as an XorFilter, keep their
+        items.
+
+        :param item: Item to delete from the filter.
+        :return: True, if item is found and deleted; False, otherwise.
+        """
+        return any(f.delete(item) for f in self.filters
+                   if hasattr(f, 'delete'))
@@ -0,0 +1,190 @@
+"""
+Semi-sorted buckets
+
+Encoding of the table of a cuckoo filter described in "Cuckoo Filter:
+Practically Better Than Bloom" by Fan et al. The fingerprints of a bucket are
+sorted, so the sequence of their four most significant bits is non-decreasing
+and is stored as its rank among all such sequences, which takes fewer bits
+than storing the bits of each fingerprint.
+"""
+
+import math
+from functools import lru_cache
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+from .compactfilter import fingerprint_dtype
+
+
+HIGH_BITS = 4
+MAX_BUCKET_SIZE = 8
+# Fields are read as 64-bit words starting from any bit of a byte.
+MAX_FIELD_BITS = 57
+
+
+def _comb(n, k):
+    if k > n:
+        return 0
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
+@lru_cache(maxsize=None)
+def _codebook(bucket_size):
+    """
+    Get the tables encoding and decoding the high bits of a bucket.
+
+    The sequence a_0 <= ... <= a_{b-1} is ranked as the combination
+    a_0 < a_1 + 1 < ... < a_{b-1} + b - 1 in the combinatorial number system.
+
+    :param bucket_size: Number of entries in a bucket
+    :return: binomial coefficients, indexed by value and position, and the
+    sequence of high bits for each rank
+    """
+    n_values = 1 << HIGH_BITS
+    binomials = np.zeros((n_values + bucket_size, bucket_size + 1),
+                         dtype=np.uint64)
+    for n in range(n_values + bucket_size):
+        for k in range(bucket_size + 1):
+            binomials[n, k] = _comb(n, k)
+
+    n_codes = _comb(n_values + bucket_size - 1, bucket_size)
+    sequences = np.zeros((n_codes, bucket_size), dtype=np.uint64)
+    for sequence in combinations_with_replacement(range(n_values),
+                                                  bucket_size):
+        code = sum(_comb(a + k, k + 1) for k, a in enumerate(sequence))
+        sequences[code] = sequence
+
+    return binomials, sequences
+
+
+def _read_bits(data, positions, width):
+    words = np.zeros(len(positions), dtype=np.uint64)
+    start = positions >> np.uint64(3)
+    for k in range(8):
+        byte = data.take((start + np.uint64(k)).astype(np.int64), mode='clip')
+        words = (words << np.uint64(8)) | byte
+    shift = np.uint64(64 - width) - (positions & np.uint64(7))
+    return (words >> shift) & np.uint64((1 << width) - 1)
+
+
+class SemiSortedTable(object):
+    """
+    Read-only table of fingerprints stored with semi-sorted buckets.
+
+    It can replace the table of a CompactCuckooFilter for lookups: indexing
+    it with bucket indices decodes the corresponding buckets.
+    """
+
+    def __init__(self, data, capacity, bucket_size, fingerprint_size):
+        """
+        Initialize SemiSortedTable object around encoded buckets.
+
+        :param data: Array of bytes holding the encoded buckets
+        :param capacity: Number of buckets
+        :param bucket_size: Number of entries in a bucket
+        :param fingerprint_size: Fingerprint size in bytes
+        """
+        low_bits = 8 * fingerprint_size - HIGH_BITS
+        if bucket_size > MAX_BUCKET_SIZE or low_bits > MAX_FIELD_BITS:
+            raise ValueError('Semi-sorted buckets support up to ' +
+                             str(MAX_BUCKET_SIZE) + ' entries of up to ' +
+                             str(MAX_FIELD_BITS + HIGH_BITS) + ' bits.')
+
+        self.data = data
+        self.shape = (capacity, bucket_size)
+        self.dtype = fingerprint_dtype(fingerprint_size)
+        self.low_bits = low_bits
+        self.binomials, self.sequences = _codebook(bucket_size)
+        self.code_bits = max(1, (len(self.sequences) - 1).bit_length())
+        self.bucket_bits = self.code_bits + bucket_size * low_bits
+
+    @classmethod
+    def encode(cls, table, fingerprint_size, chunk_size=1 << 16):
+        """
+        Encode a table of fingerprints.
+
+        :param table: Array of shape (capacity, bucket_size)
+        :param fingerprint_size: Fingerprint size in bytes
+        :param chunk_size: Number of buckets encoded at once
+        :return: the encoded table
+        """
+        capacity, bucket_size = table.shape
+        encoded = cls(None, capacity, bucket_size, fingerprint_size)
+        low_mask = np.uint64((1 << encoded.low_bits) - 1)
+
+        # A multiple of 8 buckets always ends on a byte boundary.
+        chunk_size -= chunk_size % 8
+        chunks = []
+        for start in range(0, capacity, chunk_size):
+            rows = np.sort(table[start:start + chunk_size], axis=1)
+            rows = rows.astype(np.uint64)
+            highs = rows >> np.uint64(encoded.low_bits)
+            codes = np.zeros(len(rows), dtype=np.uint64)
+            for k in range(bucket_size):
+                codes += encoded.binomials[highs[:, k].astype(np.int64) + k,
+                                           k + 1]
+
+            fields = [(codes, encoded.code_bits)] + \
+                [(rows[:, k] & low_mask, encoded.low_bits)
+                 for k in range(bucket_size)]
+            bits = np.concatenate(
+                [((values[:, None] >> np.arange(width - 1, -1, -1,
+                                                dtype=np.uint64))
+                  & np.uint64(1)).astype(np.uint8)
+                 for values, width in fields], axis=1)
+            chunks.append(np.packbits(bits.ravel()))
+
+        encoded.data = np.concatenate(chunks) if chunks \
+            else np.zeros(0, dtype=np.uint8)
+        return encoded
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __setitem__(self, key, value):
+        raise ValueError('Semi-sorted tables are read-only.')
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self[key[0]][key[1:]]
+        if np.ndim(key) == 0:
+            return self.decode(np.array([key]))[0]
+        return self.decode(np.asarray(key))
+
+    def decode(self, indices=None):
+        """
+        Decode buckets.
+
+        :param indices: Indices of the buckets, all of them if not given
+        :return: array of shape (number of indices, bucket_size)
+        """
+        if indices is None:
+            indices = np.arange(self.shape[0])
+        positions = indices.astype(np.uint64) * np.uint64(self.bucket_bits)
+
+        codes = _read_bits(self.data, positions, self.code_bits)
+        rows = self.sequences[codes.astype(np.int64)] \
+            << np.uint64(self.low_bits)
+        position = positions + np.uint64(self.code_bits)
+        for k in range(self.shape[1]):
+            rows[:, k] |= _read_bits(self.data, position, self.low_bits)
+            position += np.uint64(self.low_bits)
+
+        return rows.astype(self.dtype)
+
+
+def semi_sorted_filter(cf):
+    """
+    Get a read-only copy of a CompactCuckooFilter with semi-sorted buckets.
+
+    :param cf: CompactCuckooFilter to encode
+    :return: filter of the same class around a SemiSortedTable
+    """
+    table = SemiSortedTable.encode(cf.table, cf.fingerprint_size)
+    return type(cf).from_table(table, cf.fingerprint_size, size=cf.size,
+                               max_displacements=cf.max_displacements)
@@ -0,0 +1,211 @@
+"""
+Xor Filter
+
+Static filter built at once from all of its items, following "Xor Filters:
+Faster and Smaller Than Bloom and Cuckoo Filters" by Graf and Lemire. Each
+item is mapped to three slots, one per segment of the table, whose xor is the
+fingerprint of the item.
+"""
+
+import numpy as np
+
+from . import hashutils
+from .compactfilter import fingerprint_dtype
+
+
+XOR_FILTER_FACTOR = 1.23
+XOR_FILTER_OFFSET = 32
+XOR_FILTER_MAX_ATTEMPTS = 100
+KEY_SIZE = 8
+
+_MASK32 = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+_SEED_MULTIPLIER = 0x9e3779b97f4a7c15
+
+
+class XorFilterConstructionException(Exception):
+    """
+    Exception raised when no seed allows to build the filter.
+    """
+
+
+def _mix(key, seed):
+    # Finalizer of MurmurHash3 applied to the seeded key.
+    h = (key + seed * _SEED_MULTIPLIER) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _MASK64
+    h ^= h >> 33
+    return h
+
+
+def _mix_many(keys, seed):
+    h = keys + np.uint64((seed * _SEED_MULTIPLIER) & _MASK64)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xc4ceb9fe1a85ec53)
+    h ^= h >> np.uint64(33)
+    return h
+
+
+def _positions(h, segment_length):
+    positions = []
+    for k in range(3):
+        rotated = ((h << (21 * k)) | (h >> (64 - 21 * k))) & _MASK64 \
+            if k else h
+        positions.append((((rotated & _MASK32) * segment_length) >> 32)
+                         + k * segment_length)
+    return positions
+
+
+def _positions_many(h, segment_length):
+    positions = []
+    for k in range(3):
+        rotated = (h << np.uint64(21 * k)) | (h >> np.uint64(64 - 21 * k)) \
+            if k else h
+        reduced = ((rotated & np.uint64(_MASK32)) * np.uint64(segment_length)
+                   >> np.uint64(32))
+        positions.append(reduced.astype(np.int64) + k * segment_length)
+    return positions
+
+
+class XorFilter(object):
+    """
+    Xor Filter class.
+
+    Implements contains operations for a filter built at once with
+    from_digests(). Items can neither be inserted nor deleted afterwards.
+    """
+
+    def __init__(self, table, seed, fingerprint_size=1, size=0):
+        """
+        Initialize XorFilter object around an existing table.
+
+        :param table: Array of fingerprints, its length is a multiple of 3
+        :param seed: Seed with which the slots of the items are computed
+        :param fingerprint_size: Fingerprint size in bytes
+        :param size: Number of items in the filter
+        """
+        self.table = table
+        self.seed = seed
+        self.fingerprint_size = fingerprint_size
+        self.size = size
+        self.segment_length = len(table) // 3
+        # Each slot holds one fingerprint.
+        self.capacity = len(table)
+        self.bucket_size = 1
+
+    @classmethod
+    def from_digests(cls, digests, fingerprint_size=1, item_size=None,
+                     max_attempts=XOR_FILTER_MAX_ATTEMPTS):
+        """
+        Build a filter containing the given items.
+
+        :param digests: Iterable of items of the same size, or a contiguous
+        buffer of concatenated items
+        :param fingerprint_size: Fingerprint size in bytes
+        :param item_size: Size in bytes of an item, required for a buffer
+        :param max_attempts: Maximum number of seeds to try
+        :return: the filter
+        """
+        data = hashutils.as_array(digests, item_size)
+        keys = np.stack([hashutils.hash_codes(data, KEY_SIZE),
+                         hashutils.fingerprints(data, fingerprint_size)],
+                        axis=1)
+        # Repeated items would cancel each other out.
+        keys = np.unique(keys, axis=0)
+        fingerprints = keys[:, 1]
+        keys = keys[:, 0]
+        n_items = len(keys)
+
+        segment_length = -(-int(XOR_FILTER_FACTOR * n_items
+                                + XOR_FILTER_OFFSET) // 3)
+        capacity = 3 * segment_length
+        items = np.arange(n_items, dtype=np.int64)
+
+        for seed in range(max_attempts):
+            positions = _positions_many(_mix_many(keys, seed),
+                                        segment_length)
+
+            # Number of items mapped to each slot and xor of their indices.
+            count = np.zeros(capacity, dtype=np.int64)
+            xormask = np.zeros(capacity, dtype=np.int64)
+            for p in positions:
+                count += np.bincount(p, minlength=capacity)
+                np.bitwise_xor.at(xormask, p, items)
+
+            # Peel the items which are alone in a slot, round by round.
+            peeled = []
+            n_peeled = 0
+            singles = np.flatnonzero(count == 1)
+            while singles.size:
+                found, first = np.unique(xormask[singles], return_index=True)
+                peeled.append((found, singles[first]))
+                n_peeled += len(found)
+                for p in positions:
+                    np.subtract.at(count, p[found], 1)
+                    np.bitwise_xor.at(xormask, p[found], found)
+                singles = np.flatnonzero(count == 1)
+
+            if n_peeled == n_items:
+                break
+        else:
+            raise XorFilterConstructionException(
+                'Could not build the filter in ' + str(max_attempts) +
+                ' attempts.')
+
+        # Assign the slots in the reverse order of the peeling.
+        table = np.zeros(capacity, dtype=fingerprint_dtype(fingerprint_size))
+        fingerprints = fingerprints.astype(table.dtype)
+        for found, slots in reversed(peeled):
+            table[slots] = fingerprints[found] ^ table[positions[0][found]] \
+                ^ table[positions[1][found]] ^ table[positions[2][found]]
+
+        return cls(table, seed, fingerprint_size, n_items)
+
+    @property
+    def load_factor(self):
+        return self.size / self.capacity
+
+    def __repr__(self):
+        return '<XorFilter: capacity=' + str(self.capacity) + \
+               ', size=' + str(self.size) + ', fingerprint size=' + \
+               str(self.fingerprint_size) + ' byte(s)>'
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return self.contains(item)
+
+    def contains(self, item):
+        """
+        Check if the filter contains the item.
+
+        :param item: Item to check its presence in the filter.
+        :return: True, if item is in the filter; False, otherwise.
+        """
+        fingerprint = hashutils.fingerprint(item, self.fingerprint_size)
+        h = _mix(hashutils.hash_code(item, KEY_SIZE), self.seed)
+        i, j, k = _positions(h, self.segment_length)
+        return int(self.table[i]) ^ int(self.table[j]) ^ int(self.table[k]) \
+            == fingerprint
+
+    def contains_many(self, items, item_size=None):
+        """
+        Check if the filter contains each of many items.
+
+        :param items: List of items of the same size, or a contiguous buffer
+        of concatenated items.
+        :param item_size: Size in bytes of an item, required for a buffer.
+        :return: numpy array of booleans, True where the item is in the
+        filter.
+        """
+        data = hashutils.as_array(items, item_size)
+        fingerprints = hashutils.fingerprints(data, self.fingerprint_size)
+        h = _mix_many(hashutils.hash_codes(data, KEY_SIZE), self.seed)
+        i, j, k = _positions_many(h, self.segment_length)
+        return (self.table[i] ^ self.table[j] ^ self.table[k]) \
+            == fingerprints.astype(self.table.dtype)
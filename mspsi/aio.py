@@ -0,0 +1,286 @@
+"""
+Multi set PSI for asyncio applications
+
+The client and the server run the point operations and the probing of the filters on an
+executor, in chunks of bounded size submitted one at a time by each call. The event loop
+stays responsive, concurrent calls interleave on the executor, and partial results are
+streamed as their chunks complete.
+
+The executor is the default executor of the loop if None. It may also be a process pool,
+in which case the cache of hashed points of the client is not used, and the published
+filter is sent with every batch of documents. A client may instead open a pool of
+processes for a publication, which are handed its filter once and probe the documents
+for every stream of cardinalities of the publication. The client owns these pools, which
+are shut down by close_pool or close. Filters probed in other processes must not be
+mapped in memory.
+"""
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import AsyncIterator, List, Optional, Tuple
+
+from petlib.bn import Bn
+
+from .cache import ReplyCache
+from .mspsi import (CARDINALITY_BATCH_SIZE, MSPSIClient, MSPSIServer, PublishedFilter, count_matches, count_matches_init,
+                    count_matches_worker, decrypt_points_worker, encrypt_kwds_worker, filter_corpus, withdrawn_docs)
+from .points import Points, is_packed, iter_points, mult_points, pack_points, point_size, points_form
+
+
+ASYNC_CHUNK_SIZE = 64
+
+
+def _chunks(items:list, chunk_size:int) -> List[list]:
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+class AsyncMSPSIClient:
+    """
+    Client for a multi set PSI, for asyncio applications
+    """
+
+    def __init__(self, client:MSPSIClient, executor:Optional[Executor]=None, chunk_size:int=ASYNC_CHUNK_SIZE, batch_size:int=CARDINALITY_BATCH_SIZE, processes:Optional[int]=None):
+        """
+        Constructor for the asynchronous client of a multi set PSI
+
+        :param client: client running the protocol, with its curve, cache and point form
+        :param executor: thread or process pool on which to run the computations, None for the default executor of the loop
+        :param chunk_size: number of keywords or points submitted at once to the executor
+        :param batch_size: number of documents probed at once on the executor
+        :param processes: number of processes of the pools opened for publications, None for one per CPU
+        """
+
+        self.client = client
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.processes = processes
+        self.pools = dict()
+
+
+    def open_pool(self, published:Tuple[int, PublishedFilter]):
+        """
+        Open a pool of processes probing the filter of a publication.
+
+        Each process is handed the filter once, and the pool serves every stream of
+        cardinalities of the publication, whatever the executor, until it is closed. The
+        processes are started by the first batch probed on the pool.
+
+        :param published: publication to be probed
+        """
+
+        published_data = published[1]
+        # The filter is kept with its pool, so that its id is not reused while the pool is open.
+        if id(published_data) in self.pools:
+            raise ValueError("A pool is already open for the publication.")
+
+        pool = ProcessPoolExecutor(self.processes, initializer=count_matches_init, initargs=(published_data,))
+        self.pools[id(published_data)] = (published_data, pool)
+
+
+    def close_pool(self, published:Tuple[int, PublishedFilter], wait:bool=True):
+        """
+        Shut down the pool of processes probing the filter of a publication.
+
+        :param published: publication whose pool was opened with open_pool
+        :param wait: whether to wait for the processes to exit
+        """
+
+        if id(published[1]) not in self.pools:
+            raise ValueError("No pool is open for the publication.")
+
+        _, pool = self.pools.pop(id(published[1]))
+        pool.shutdown(wait)
+
+
+    def close(self, wait:bool=True):
+        """
+        Shut down the pools of processes of every publication.
+
+        :param wait: whether to wait for the processes to exit
+        """
+
+        for _, pool in self.pools.values():
+            pool.shutdown(wait)
+        self.pools.clear()
+
+
+    async def query(self, kwds:List[str], packed:bool=False) -> Tuple[Bn, Points]:
+        """
+        Generate a query from the keywords.
+
+        :param kwds: keywords to be queried
+        :param packed: whether to pack the points of the query in a single buffer
+        :return: a secret to generate the query and the query itself
+        """
+
+        loop = asyncio.get_running_loop()
+        group = self.client.group
+        form = self.client.point_form
+
+        secret = group.order().random()
+        # Caches hold locks, which cannot be sent to other processes.
+        cache = self.client.cache if not isinstance(self.executor, ProcessPoolExecutor) else None
+        worker = partial(encrypt_kwds_worker, group.nid(), secret.binary(), form, cache)
+
+        query_enc = list()
+        for chunk in _chunks(list(kwds), self.chunk_size):
+            query_enc.extend(await loop.run_in_executor(self.executor, worker, chunk))
+
+        if packed:
+            return (secret, pack_points(query_enc, len(query_enc), point_size(group, form), form))
+
+        return (secret, query_enc)
+
+
+    async def decrypt_reply(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter]) -> List[bytes]:
+        """
+        Decrypt the keywords of a reply, discarding the ones absent from the corpus-wide
+        filter of the publication if it has one.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :return: the decrypted keywords which may match a document
+        """
+
+        loop = asyncio.get_running_loop()
+        group = self.client.group
+
+        secret_inv = secret.mod_inverse(group.order())
+        worker = partial(decrypt_points_worker, group.nid(), secret_inv.binary())
+
+        kwds_dec = list()
+        for chunk in _chunks(list(iter_points(reply)), self.chunk_size):
+            kwds_dec.extend(await loop.run_in_executor(self.executor, worker, chunk))
+
+        return filter_corpus(published, kwds_dec)
+
+
+    async def compute_cardinalities_stream(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter]) -> AsyncIterator[Tuple[int, List[int]]]:
+        """
+        Compute the cardinalities of a reply, batch of documents by batch of documents.
+
+        The documents are probed on the pool of the publication if one was opened, and on
+        the executor otherwise.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :return: an asynchronous iterator over the id of the first document of each batch and the cardinalities of the documents of the batch
+        """
+
+        loop = asyncio.get_running_loop()
+        n_docs = published[0]
+        published_data = published[1]
+        withdrawn = withdrawn_docs(published)
+
+        kwds_dec = await self.decrypt_reply(secret, reply, published)
+        pool = self.pools.get(id(published_data))
+
+        for doc_id_start in range(0, n_docs, self.batch_size):
+            doc_id_end = min(doc_id_start + self.batch_size, n_docs)
+            if not kwds_dec:
+                yield (doc_id_start, [0] * (doc_id_end - doc_id_start))
+                continue
+            if pool is not None:
+                worker = partial(count_matches_worker, kwds_decs=[kwds_dec])
+                cardinalities = (await loop.run_in_executor(pool[1], worker, (doc_id_start, doc_id_end)))[0]
+            else:
+                cardinalities = await loop.run_in_executor(self.executor, count_matches, published_data, kwds_dec, doc_id_start, doc_id_end)
+            for doc_id in withdrawn:
+                if doc_id_start <= doc_id < doc_id_end:
+                    cardinalities[doc_id - doc_id_start] = 0
+            yield (doc_id_start, cardinalities)
+
+
+    async def compute_cardinalities(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter]) -> List[int]:
+        """
+        Compute the cardinalyty of the intersection of sets between the reply to a query
+        and the list of lists of points published by the server.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :return: list of cardinalities for the intersection between the reply and each published list of points.
+        """
+
+        cardinalities = list()
+
+        async for _, batch_cardinalities in self.compute_cardinalities_stream(secret, reply, published):
+            cardinalities.extend(batch_cardinalities)
+
+        return cardinalities
+
+
+
+class AsyncMSPSIServer:
+    """
+    Server for a multi set PSI, for asyncio applications
+    """
+
+    def __init__(self, server:MSPSIServer, executor:Optional[Executor]=None, chunk_size:int=ASYNC_CHUNK_SIZE):
+        """
+        Constructor for the asynchronous server of a multi set PSI
+
+        :param server: server running the protocol, with its curve, point form and reply cache
+        :param executor: thread or process pool on which to run the computations, None for the default executor of the loop
+        :param chunk_size: number of points submitted at once to the executor
+        """
+
+        self.server = server
+        self.executor = executor
+        self.chunk_size = chunk_size
+
+
+    async def reply_stream(self, secret:Bn, query:Points) -> AsyncIterator[List[bytes]]:
+        """
+        Compute a reply to a query, chunk of points by chunk of points.
+
+        :param secret: secret with which the keywords were encrypted during the publication
+        :param query: query to be answered
+        :return: an asynchronous iterator over the exported points of the reply, by chunk, in the order of the query
+        """
+
+        loop = asyncio.get_running_loop()
+        group = self.server.group
+        cache = self.server.reply_cache
+
+        form = self.server.point_form if self.server.point_form is not None else points_form(query)
+        scope = ReplyCache.scope(secret, form) if cache is not None else None
+        worker = partial(mult_points, group.nid(), secret.binary(), form=form)
+
+        for chunk in _chunks(list(iter_points(query)), self.chunk_size):
+            if cache is None:
+                yield await loop.run_in_executor(self.executor, worker, chunk)
+                continue
+
+            # Only the points missing from the cache are sent to the executor.
+            replies, missing = cache.get_many(scope, chunk)
+            products = await loop.run_in_executor(self.executor, worker, missing) if missing else []
+            cache.put_many(scope, missing, products)
+
+            products = iter(products)
+            yield [reply if reply is not None else next(products) for reply in replies]
+
+
+    async def reply(self, secret:Bn, query:Points) -> Points:
+        """
+        Compute a reply to a query.
+
+        :param secret: secret with which the keywords were encrypted during the publication
+        :param query: query to be answered
+        :return: reply to the query, packed if the query is
+        """
+
+        reply = list()
+
+        async for chunk in self.reply_stream(secret, query):
+            reply.extend(chunk)
+
+        if is_packed(query):
+            form = self.server.point_form if self.server.point_form is not None else points_form(query)
+            return pack_points(reply, len(reply), point_size(self.server.group, form), form)
+
+        return reply
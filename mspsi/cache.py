@@ -0,0 +1,283 @@
+"""
+Caches of the points to which keywords are hashed and of the replies to query points
+"""
+
+import dbm
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from petlib.bn import Bn
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED
+
+
+ENCODING_DEFAULT = "utf-8"
+POINT_CACHE_SIZE_DEFAULT = 100000
+REPLY_CACHE_SIZE_DEFAULT = 100000
+REPLY_CACHE_SCOPE_SIZE = 16
+
+
+class PointCache:
+    """
+    Two-tier cache of the points to which keywords are hashed.
+
+    Points are looked up in a bounded in-memory LRU, then in an optional on-disk store,
+    and only hashed to the curve when both miss. Entries are keyed by the NID of the
+    curve and the keyword, so a single cache can serve several curves.
+
+    The on-disk store is keyed by the keywords in plaintext, and every keyword missing
+    from a writable store is written to it. A client hashing its queries through a
+    writable store therefore keeps on disk every keyword it ever searched for. Clients
+    should rather prewarm a store with a vocabulary, then open it read-only, so that the
+    keywords of their queries are only kept in memory.
+    """
+
+    def __init__(self, maxsize:int=POINT_CACHE_SIZE_DEFAULT, path:Optional[str]=None, readonly:bool=False):
+        """
+        Constructor for a cache of hashed keywords.
+
+        :param maxsize: maximal number of points kept in memory
+        :param path: path of the on-disk store, created if needed unless it is read-only, None to keep points in memory only
+        :param readonly: whether the on-disk store is only read, so that the keywords missing from it are not recorded
+        """
+
+        self.maxsize = maxsize
+        self.points = OrderedDict()
+        self.readonly = readonly
+        self.store = dbm.open(path, "r" if readonly else "c") if path is not None else None
+        self.lock = Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+
+    def close(self):
+        """
+        Close the on-disk store.
+        """
+
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+    def _remember(self, key:tuple, pt:EcPt):
+        self.points[key] = pt
+        if len(self.points) > self.maxsize:
+            self.points.popitem(last=False)
+
+
+    def hash_to_point(self, group:EcGroup, kwd:bytes) -> EcPt:
+        """
+        Hash a keyword to a point of the curve, going through the cache.
+
+        :param group: elliptic curve group
+        :param kwd: encoded keyword
+        :return: the point to which the keyword is hashed
+        """
+
+        key = (group.nid(), kwd)
+
+        store_key = key[0].to_bytes(4, byteorder="big") + kwd
+
+        with self.lock:
+            pt = self.points.get(key)
+            if pt is not None:
+                self.points.move_to_end(key)
+                self.hits += 1
+                return pt
+
+            pt_bytes = self.store.get(store_key) if self.store is not None else None
+
+        if pt_bytes is not None:
+            pt = EcPt.from_binary(pt_bytes, group)
+        else:
+            pt = group.hash_to_point(kwd)
+
+        with self.lock:
+            if pt_bytes is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                if self.store is not None and not self.readonly:
+                    # Uncompressed points are decoded without computing a square root.
+                    self.store[store_key] = pt.export(POINT_CONVERSION_UNCOMPRESSED)
+            self._remember(key, pt)
+
+        return pt
+
+
+    def prewarm(self, group:EcGroup, path:str, encoding:str=ENCODING_DEFAULT) -> int:
+        """
+        Hash the keywords of a vocabulary file into the cache.
+
+        The keywords are written to the on-disk store unless it is read-only, in which
+        case they are only kept in memory.
+
+        :param group: elliptic curve group
+        :param path: path of the vocabulary file, with one keyword per line
+        :param encoding: encoding of the vocabulary file and of the keywords
+        :return: the number of keywords in the vocabulary
+        """
+
+        n_kwds = 0
+
+        with open(path, "r", encoding=encoding) as fd:
+            for line in fd:
+                kwd = line.rstrip("\r\n")
+                self.hash_to_point(group, kwd.encode(encoding))
+                n_kwds += 1
+
+        return n_kwds
+
+
+class ReplyCache:
+    """
+    Bounded LRU cache of the products of query points with the secrets of publications.
+
+    Entries are scoped by a digest of the secret and of the point form, so a single cache
+    can serve several publications without holding their secrets. A query point is the
+    hash of a keyword blinded by a secret of the client, so the cache only hits when a
+    client sends a point again, for instance when it retries a query or reuses its secret
+    across queries. Enabling the cache is a privacy choice of each deployment: replies
+    served from the cache are faster, which reveals to an observer of the timing that a
+    point was queried recently, and the points of past queries are kept in memory along
+    with their replies.
+    """
+
+    def __init__(self, maxsize:int=REPLY_CACHE_SIZE_DEFAULT):
+        """
+        Constructor for a cache of replies.
+
+        :param maxsize: maximal number of replied points kept in memory
+        """
+
+        self.maxsize = maxsize
+        self.replies = OrderedDict()
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self.replies)
+
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+    @staticmethod
+    def scope(secret:Bn, form:int) -> bytes:
+        """
+        Get the scope of the replies made with a secret.
+
+        :param secret: secret of the publication
+        :param form: form in which the replied points are exported
+        :return: the scope, to be passed to get and put
+        """
+
+        return blake2b(bytes([form]) + secret.binary(), digest_size=REPLY_CACHE_SCOPE_SIZE).digest()
+
+
+    def get(self, scope:bytes, pt_bytes:bytes) -> Optional[bytes]:
+        """
+        Look up the reply to a query point.
+
+        :param scope: scope of the secret, as returned by scope
+        :param pt_bytes: exported query point
+        :return: the exported reply point, None if it is not cached
+        """
+
+        key = (scope, pt_bytes)
+
+        with self.lock:
+            reply = self.replies.get(key)
+            if reply is None:
+                self.misses += 1
+                return None
+            self.replies.move_to_end(key)
+            self.hits += 1
+            return reply
+
+
+    def put(self, scope:bytes, pt_bytes:bytes, reply:bytes):
+        """
+        Remember the reply to a query point.
+
+        :param scope: scope of the secret, as returned by scope
+        :param pt_bytes: exported query point
+        :param reply: exported reply point
+        """
+
+        with self.lock:
+            self.replies[(scope, pt_bytes)] = reply
+            if len(self.replies) > self.maxsize:
+                self.replies.popitem(last=False)
+
+
+    def get_many(self, scope:bytes, points:List[bytes]) -> Tuple[List[Optional[bytes]], List[bytes]]:
+        """
+        Look up the replies to many query points.
+
+        :param scope: scope of the secret, as returned by scope
+        :param points: exported query points
+        :return: the exported reply point of each query point, None if it is not cached, and the query points missing from the cache
+        """
+
+        replies = [self.get(scope, pt_bytes) for pt_bytes in points]
+        missing = [pt_bytes for pt_bytes, reply in zip(points, replies) if reply is None]
+        return (replies, missing)
+
+
+    def put_many(self, scope:bytes, points:List[bytes], replies:List[bytes]):
+        """
+        Remember the replies to many query points.
+
+        :param scope: scope of the secret, as returned by scope
+        :param points: exported query points
+        :param replies: exported reply points, in the order of the query points
+        """
+
+        for pt_bytes, reply in zip(points, replies):
+            self.put(scope, pt_bytes, reply)
+
+
+    def clear(self, secret:Optional[Bn]=None):
+        """
+        Forget the cached replies, for instance when a publication is withdrawn.
+
+        :param secret: secret whose replies are forgotten, every reply if None
+        """
+
+        with self.lock:
+            if secret is None:
+                self.replies.clear()
+                return
+            scopes = {self.scope(secret, form) for form in (POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED)}
+            for key in [key for key in self.replies if key[0] in scopes]:
+                del self.replies[key]
+
+
+def hash_to_point(group:EcGroup, kwd:bytes, cache:Optional[PointCache]=None) -> EcPt:
+    """
+    Hash a keyword to a point of the curve, through a cache if there is one.
+
+    :param group: elliptic curve group
+    :param kwd: encoded keyword
+    :param cache: cache of hashed keywords
+    :return: the point to which the keyword is hashed
+    """
+
+    if cache is None:
+        return group.hash_to_point(kwd)
+    return cache.hash_to_point(group, kwd)
@@ -2,10 +2,14 @@
 Single set PSI
 """
 
-from typing import List, Tuple
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
 
 from petlib.bn import Bn
-from petlib.ec import EcGroup, EcPt
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_COMPRESSED
+
+from .cache import PointCache, ReplyCache, hash_to_point
+from .points import Points, check_form, iter_points, mult_queries, mult_query, pack_points, point_size
 
 
 EC_NID_DEFAULT = 415
@@ -17,22 +21,27 @@ class CPSIClient:
     Client for a single set PSI
     """
 
-    def __init__(self, curve:int=EC_NID_DEFAULT):
+    def __init__(self, curve:int=EC_NID_DEFAULT, cache:Optional[PointCache]=None, point_form:int=POINT_CONVERSION_COMPRESSED):
         """
         Constructor for the client of a single set PSI
 
         :param curve: NID of the elliptic curve to use.
+        :param cache: cache of the points to which keywords are hashed
+        :param point_form: form in which the points of the queries are exported, POINT_CONVERSION_COMPRESSED or POINT_CONVERSION_UNCOMPRESSED
         """
 
         self.group = EcGroup(curve)
+        self.cache = cache
+        self.point_form = check_form(point_form)
 
 
-    def query(self, kwds:List[str]) -> Tuple[Bn, List[bytes]]:
+    def query(self, kwds:List[str], packed:bool=False) -> Tuple[Bn, Points]:
         """
         Generate a query from the keywords.
 
-        :param kwds_ms: Multi set of keywords to be queried.
-        :return: a query
+        :param kwds: Multi set of keywords to be queried.
+        :param packed: whether to pack the points of the query in a single buffer, which the reply then is too.
+        :return: a secret to generate the query and the query itself
         """
 
         secret = self.group.order().random()
@@ -40,15 +49,18 @@ class CPSIClient:
         query_enc = list()
 
         for kwd in kwds:
-            kwd_pt = self.group.hash_to_point(kwd.encode(ENCODING_DEFAULT))
+            kwd_pt = hash_to_point(self.group, kwd.encode(ENCODING_DEFAULT), self.cache)
             kwd_enc = secret * kwd_pt
-            kwd_enc_bytes = kwd_enc.export()
+            kwd_enc_bytes = kwd_enc.export(self.point_form)
             query_enc.append(kwd_enc_bytes)
 
+        if packed:
+            return (secret, pack_points(query_enc, len(query_enc), point_size(self.group, self.point_form), self.point_form))
+
         return (secret, query_enc)
 
 
-    def compute_cardinality(self, secret:Bn, reply:List[bytes], published) -> int:
+    def compute_cardinality(self, secret:Bn, reply:Points, published) -> int:
         """
         Compute the cardinalyty of the intersection of sets between the reply to a query
         and the list of points published by the server.
@@ -62,7 +74,7 @@ class CPSIClient:
 
         kwds = list()
 
-        for kwd_h in reply:
+        for kwd_h in iter_points(reply):
             kwd_pt = EcPt.from_binary(kwd_h, self.group)
             kwd_pt_dec = secret_inv * kwd_pt
             kwd_bytes = kwd_pt_dec.export()
@@ -77,15 +89,21 @@ class CPSIServer:
     Server for a single set PSI
     """
 
-    def __init__(self, curve:int=EC_NID_DEFAULT):
+    def __init__(self, curve:int=EC_NID_DEFAULT, cache:Optional[PointCache]=None, point_form:Optional[int]=None, reply_cache:Optional[ReplyCache]=None):
         """
         Constructor for the server of a single set PSI
 
         :param curve: NID of the elliptic curve to use.
+        :param cache: cache of the points to which keywords are hashed
+        :param point_form: form in which the points of the replies are exported, the form of each query if None
+        :param reply_cache: cache of the replies to query points, None to compute every reply, see ReplyCache for its privacy implications
         :return:
         """
 
         self.group = EcGroup(curve)
+        self.cache = cache
+        self.point_form = check_form(point_form) if point_form is not None else None
+        self.reply_cache = reply_cache
 
 
     def publish(self, kwds:List[str]) -> Tuple[Bn, List[bytes]]:
@@ -101,7 +119,7 @@ class CPSIServer:
         pub = list()
 
         for kwd in kwds:
-            kwd_pt = self.group.hash_to_point(kwd.encode(ENCODING_DEFAULT))
+            kwd_pt = hash_to_point(self.group, kwd.encode(ENCODING_DEFAULT), self.cache)
             kwd_enc = secret * kwd_pt
             kwd_enc_bytes = kwd_enc.export()
             pub.append(kwd_enc_bytes)
@@ -109,7 +127,7 @@ class CPSIServer:
         return (secret, pub)
 
 
-    def reply(self, secret:Bn, query:List[bytes]) -> List[bytes]:
+    def reply(self, secret:Bn, query:Points) -> Points:
         """
         Compute a reply to a query.
 
@@ -117,12 +135,19 @@ class CPSIServer:
         :return: reply to the query
         """
 
-        reply = list()
+        return mult_query(self.group, secret, query, self.point_form, self.reply_cache)
 
-        for kwd_h in query:
-            kwd_pt = EcPt.from_binary(kwd_h, self.group)
-            kwd_enc = secret * kwd_pt
-            kwd_enc_bytes = kwd_enc.export()
-            reply.append(kwd_enc_bytes)
 
-        return reply
+    def reply_many(self, secret:Bn, queries:List[Points], executor:Optional[Executor]=None) -> List[Points]:
+        """
+        Compute the replies to many queries.
+
+        Points occurring several times in the batch are multiplied only once.
+
+        :param secret: secret with which the keywords were encrypted during the publication
+        :param queries: queries to be answered
+        :param executor: thread or process pool on which to run the point multiplications
+        :return: replies to the queries, in the order of the queries
+        """
+
+        return mult_queries(self.group, secret, queries, executor, self.point_form, self.reply_cache)
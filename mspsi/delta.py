@@ -0,0 +1,344 @@
+"""
+Delta encoding of updated publications
+
+A delta holds the number of documents of a new revision of a publication, the ids of its
+withdrawn documents and, for each filter, the indices of the buckets whose contents
+changed since the previous revision with their new contents. Filters whose layout
+changed, such as a chain which grew, are sent whole. Deltas are applied either to a
+publication held in memory or to a serialized publication, which is patched in place
+when its layout did not change and rewritten otherwise.
+
+Publications mapped from a file by load_mapped see the patched buckets through the page
+cache, but the number of documents and the sizes of the filters are read when the file
+is opened, and a rewritten file is a new file. Mapped publications must therefore be
+opened again with load_mapped once a delta is applied, which copies nothing.
+"""
+
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import msgpack
+import numpy as np
+
+from cuckoopy_mod import CompactCuckooFilter, ScalableCuckooFilter, SemiSortedTable, XorFilter
+from cuckoopy_mod.compactfilter import fingerprint_dtype
+
+from .mspsi import EC_NID_DEFAULT, Publication, PublishedFilter, withdrawn_docs
+from .publication import (CUCKOO_FILTER_TYPES, COMPRESSION_NONE, ENCODING_PLAIN, FILTER_SCALABLE, FILTER_XOR, FORMAT_MAGIC,
+                          FORMAT_VERSION, HEADER_LENGTH_SIZE, dump, filter_type, load, load_header, pack_header,
+                          payload_offsets)
+
+
+DELTA_MAGIC = b"DSND"
+DELTA_INDEX_DTYPE = np.dtype("<u4")
+LAYOUT_KEYS = ("type", "capacity", "bucket_size", "fingerprint_size", "seed")
+
+
+def _chain(published_data:Optional[PublishedFilter]) -> List[PublishedFilter]:
+    if published_data is None:
+        return []
+    if isinstance(published_data, ScalableCuckooFilter):
+        return published_data.filters
+    return [published_data]
+
+
+def _layout(published_data:PublishedFilter) -> dict:
+    layout = {
+        "type": filter_type(published_data),
+        "capacity": published_data.capacity,
+        "fingerprint_size": published_data.fingerprint_size,
+    }
+    if isinstance(published_data, XorFilter):
+        layout["seed"] = published_data.seed
+    else:
+        layout["bucket_size"] = published_data.bucket_size
+    return layout
+
+
+def _header_layout(header:dict) -> dict:
+    return {key: header[key] for key in LAYOUT_KEYS if key in header}
+
+
+def _rows(published_data:PublishedFilter) -> np.ndarray:
+    # Buckets of a filter as the rows of an array, the slots of a xor filter being buckets of one entry.
+    if isinstance(published_data, XorFilter):
+        return published_data.table.reshape(-1, 1)
+    if not isinstance(published_data, CompactCuckooFilter):
+        published_data = CompactCuckooFilter.from_filter(published_data)
+    if isinstance(published_data.table, SemiSortedTable):
+        return published_data.table.decode()
+    return published_data.table
+
+
+def _diff_filter(old:Optional[PublishedFilter], new:PublishedFilter) -> dict:
+    if isinstance(new, ScalableCuckooFilter):
+        old_filters = _chain(old)
+        return {
+            "type": FILTER_SCALABLE,
+            "growth_factor": new.growth_factor,
+            "filters": [_diff_filter(old_filters[k] if k < len(old_filters) else None, f) for k, f in enumerate(new.filters)],
+        }
+
+    # Filters whose layout changed are sent again, as a delta from an empty filter.
+    layout = _layout(new)
+    rows = _rows(new)
+    reset = old is None or isinstance(old, ScalableCuckooFilter) or _layout(old) != layout
+    if reset:
+        changed = np.flatnonzero(rows.any(axis=1))
+    else:
+        changed = np.flatnonzero((_rows(old) != rows).any(axis=1))
+
+    layout.update({
+        "size": new.size,
+        "reset": reset,
+        "buckets": changed.astype(DELTA_INDEX_DTYPE).tobytes(),
+        "contents": rows[changed].astype(rows.dtype.newbyteorder("<")).tobytes(),
+    })
+    return layout
+
+
+def dumps(old:Tuple[int, PublishedFilter], new:Tuple[int, PublishedFilter], base_revision:int, curve:int=EC_NID_DEFAULT) -> bytes:
+    """
+    Encode the changes between two revisions of a publication.
+
+    :param old: publication at the base revision
+    :param new: publication at the following revision
+    :param base_revision: revision of the old publication
+    :param curve: NID of the elliptic curve with which the publication was made
+    :return: the delta from the old to the new publication
+    """
+
+    if len(old) != len(new):
+        raise ValueError("The publications do not have the same number of filters.")
+
+    delta = {
+        "version": FORMAT_VERSION,
+        "curve": curve,
+        "base_revision": base_revision,
+        "revision": base_revision + 1,
+        "n_docs": new[0],
+        "withdrawn": sorted(withdrawn_docs(new)),
+        "filters": [_diff_filter(old_data, new_data) for old_data, new_data in zip(old[1:], new[1:])],
+    }
+
+    return DELTA_MAGIC + msgpack.packb(delta)
+
+
+def loads(data:bytes, curve:int=EC_NID_DEFAULT) -> dict:
+    """
+    Decode a delta.
+
+    :param data: delta as returned by dumps
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the delta, with its base_revision, revision, n_docs, withdrawn and filters
+    """
+
+    if data[:len(DELTA_MAGIC)] != DELTA_MAGIC:
+        raise ValueError("Not a publication delta.")
+
+    delta = msgpack.unpackb(data[len(DELTA_MAGIC):])
+
+    if delta["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported publication format version: {}".format(delta["version"]))
+    if delta["curve"] != curve:
+        raise ValueError("Publication made on curve {} instead of {}.".format(delta["curve"], curve))
+
+    return delta
+
+
+def _changes(filter_delta:dict) -> Tuple[np.ndarray, np.ndarray]:
+    buckets = np.frombuffer(filter_delta["buckets"], dtype=DELTA_INDEX_DTYPE).astype(np.int64)
+    dtype = fingerprint_dtype(filter_delta["fingerprint_size"])
+    contents = np.frombuffer(filter_delta["contents"], dtype=dtype.newbyteorder("<")).astype(dtype)
+    return (buckets, contents.reshape(len(buckets), filter_delta.get("bucket_size", 1)))
+
+
+def _new_filter(filter_delta:dict) -> PublishedFilter:
+    if filter_delta["type"] == FILTER_XOR:
+        table = np.zeros(filter_delta["capacity"], dtype=fingerprint_dtype(filter_delta["fingerprint_size"]))
+        return XorFilter(table, filter_delta["seed"], filter_delta["fingerprint_size"])
+    if filter_delta["type"] not in CUCKOO_FILTER_TYPES:
+        raise ValueError("Unsupported filter type: {}".format(filter_delta["type"]))
+    return CUCKOO_FILTER_TYPES[filter_delta["type"]](filter_delta["capacity"], filter_delta["bucket_size"], filter_delta["fingerprint_size"])
+
+
+def _check_filter(published_data:Optional[PublishedFilter], filter_delta:dict):
+    if filter_delta["type"] == FILTER_SCALABLE:
+        old_filters = _chain(published_data)
+        for k, d in enumerate(filter_delta["filters"]):
+            _check_filter(old_filters[k] if k < len(old_filters) else None, d)
+        return
+
+    if published_data is None or filter_delta["reset"]:
+        if filter_delta["type"] != FILTER_XOR and filter_delta["type"] not in CUCKOO_FILTER_TYPES:
+            raise ValueError("Unsupported filter type: {}".format(filter_delta["type"]))
+        return
+
+    if _layout(published_data) != _header_layout(filter_delta):
+        raise ValueError("The delta does not match the layout of the filter.")
+    if not isinstance(published_data, (CompactCuckooFilter, XorFilter)) or isinstance(published_data.table, SemiSortedTable):
+        raise ValueError("Deltas can only be applied to plain compact filters.")
+    if not published_data.table.flags.writeable:
+        raise ValueError("Deltas cannot be applied to filters mapped in memory, the file is updated with apply_file.")
+
+
+def _apply_filter(published_data:Optional[PublishedFilter], filter_delta:dict) -> PublishedFilter:
+    if filter_delta["type"] == FILTER_SCALABLE:
+        old_filters = _chain(published_data)
+        filters = [_apply_filter(old_filters[k] if k < len(old_filters) else None, d) for k, d in enumerate(filter_delta["filters"])]
+        if isinstance(published_data, ScalableCuckooFilter):
+            published_data.filters = filters
+            return published_data
+        return ScalableCuckooFilter.from_filters(filters, filter_delta["growth_factor"])
+
+    if published_data is None or filter_delta["reset"]:
+        published_data = _new_filter(filter_delta)
+
+    buckets, contents = _changes(filter_delta)
+    _rows(published_data)[buckets] = contents
+    published_data.size = filter_delta["size"]
+
+    return published_data
+
+
+def apply(published:Tuple[int, PublishedFilter], data:bytes, revision:int, curve:int=EC_NID_DEFAULT) -> Publication:
+    """
+    Apply a delta to a publication held in memory.
+
+    The filters are updated in place when their layout did not change, once the delta
+    was checked against every filter, so that a delta which does not match leaves the
+    publication as is. Publications mapped in memory are read-only, the file they are
+    mapped from is updated with apply_file instead.
+
+    :param published: publication at the base revision of the delta
+    :param data: delta as returned by dumps
+    :param revision: revision of the publication
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the publication at the revision of the delta
+    """
+
+    delta = loads(data, curve)
+
+    if delta["base_revision"] != revision:
+        raise ValueError("Delta from revision {} applied to revision {}.".format(delta["base_revision"], revision))
+    if len(delta["filters"]) != len(published) - 1:
+        raise ValueError("The delta does not have the filters of the publication.")
+
+    # Every filter is checked before any of them is modified.
+    for published_data, filter_delta in zip(published[1:], delta["filters"]):
+        _check_filter(published_data, filter_delta)
+
+    filters = [_apply_filter(published_data, filter_delta) for published_data, filter_delta in zip(published[1:], delta["filters"])]
+
+    return Publication(delta["n_docs"], filters, delta["withdrawn"])
+
+
+def _payload_writes(filter_header:dict, offset:int, filter_delta:dict) -> Optional[List[Tuple[int, bytes]]]:
+    # None when the payload cannot be patched in place.
+    if filter_delta["type"] == FILTER_SCALABLE:
+        if filter_header["type"] != FILTER_SCALABLE or len(filter_header["filters"]) != len(filter_delta["filters"]):
+            return None
+        writes = list()
+        for sub_header, sub_offset, sub_delta in zip(filter_header["filters"], payload_offsets(filter_header, offset), filter_delta["filters"]):
+            sub_writes = _payload_writes(sub_header, sub_offset, sub_delta)
+            if sub_writes is None:
+                return None
+            writes.extend(sub_writes)
+        return writes
+
+    if filter_header["type"] == FILTER_SCALABLE or filter_delta["reset"] or _header_layout(filter_header) != _header_layout(filter_delta):
+        return None
+    if filter_header.get("encoding", ENCODING_PLAIN) != ENCODING_PLAIN:
+        raise ValueError("Deltas can only be applied to plain publications.")
+    if filter_header["compression"] != COMPRESSION_NONE:
+        return None
+
+    filter_header["size"] = filter_delta["size"]
+
+    buckets, contents = _changes(filter_delta)
+    contents = contents.astype(contents.dtype.newbyteorder("<"))
+    row_size = contents.shape[1] * contents.dtype.itemsize
+    return [(offset + bucket * row_size, row.tobytes()) for bucket, row in zip(buckets.tolist(), contents)]
+
+
+def _compressed(filter_header:dict) -> bool:
+    if filter_header["type"] == FILTER_SCALABLE:
+        return any(_compressed(sub_header) for sub_header in filter_header["filters"])
+    return filter_header["compression"] != COMPRESSION_NONE
+
+
+def _rewrite_file(path:str, data:bytes, header:dict, curve:int):
+    with open(path, "rb") as fd:
+        published = load(fd, curve)
+
+    published = apply(published, data, header.get("revision", 0), curve)
+    compress = any(_compressed(filter_header) for filter_header in header["filters"])
+
+    # The new file replaces the old one at once, publications mapped from it are unaffected.
+    fd = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    try:
+        with fd:
+            dump(published, fd, curve, compress, revision=header.get("revision", 0) + 1)
+        os.replace(fd.name, path)
+    except BaseException:
+        os.unlink(fd.name)
+        raise
+
+
+def apply_file(path:str, data:bytes, curve:int=EC_NID_DEFAULT) -> int:
+    """
+    Apply a delta to a serialized publication.
+
+    When the layout of the filters did not change and the file is not compressed, only
+    the changed buckets and the header are rewritten in place. Otherwise, the publication
+    is loaded, updated and written again to the same path. Files with semi-sorted buckets
+    cannot be updated. Publications mapped from the file must be opened again with
+    load_mapped afterwards.
+
+    :param path: path of the serialized publication
+    :param data: delta as returned by dumps
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the new revision of the publication
+    """
+
+    delta = loads(data, curve)
+
+    with open(path, "r+b") as fd:
+        header, offset = load_header(fd, curve)
+
+        if delta["base_revision"] != header.get("revision", 0):
+            raise ValueError("Delta from revision {} applied to revision {}.".format(delta["base_revision"], header.get("revision", 0)))
+        if len(delta["filters"]) != len(header["filters"]):
+            raise ValueError("The delta does not have the filters of the publication.")
+
+        # Every change is checked before the file is modified.
+        writes = list()
+        for filter_header, filter_offset, filter_delta in zip(header["filters"], payload_offsets(header, offset), delta["filters"]):
+            filter_writes = _payload_writes(filter_header, filter_offset, filter_delta)
+            if filter_writes is None:
+                writes = None
+                break
+            writes.extend(filter_writes)
+
+        if writes is not None:
+            rewritten = dict(header, n_docs=delta["n_docs"], withdrawn=delta["withdrawn"], revision=delta["revision"])
+
+            fd.seek(len(FORMAT_MAGIC))
+            header_length = int.from_bytes(fd.read(HEADER_LENGTH_SIZE), byteorder="big")
+            try:
+                packed = pack_header(rewritten, header_length)
+            except ValueError:
+                writes = None
+
+        if writes is not None:
+            for position, contents in writes:
+                fd.seek(position)
+                fd.write(contents)
+            fd.seek(len(FORMAT_MAGIC) + HEADER_LENGTH_SIZE)
+            fd.write(packed)
+
+    if writes is None:
+        _rewrite_file(path, data, header, curve)
+
+    return delta["revision"]
@@ -2,22 +2,59 @@
 Multi set PSI
 """
 
+import heapq
+from concurrent.futures import Executor
+from functools import partial
 from hashlib import blake2b
-from typing import List, Tuple
+from itertools import count, islice
+from multiprocessing import Pool, cpu_count
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Type, Union
 
+import numpy as np
 from petlib.bn import Bn
-from petlib.ec import EcGroup, EcPt
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_COMPRESSED
 
-from cuckoopy_mod import CuckooFilter
+from cuckoopy_mod import CompactCuckooFilter, CuckooFilter, HighLoadCuckooFilter, ScalableCuckooFilter, SemiSortedTable, XorFilter
+from cuckoopy_mod.cuckoofilter import CuckooFilterFullException
 
+from .cache import PointCache, ReplyCache, hash_to_point
+from .points import Points, check_form, iter_points, mult_queries, mult_query, mult_query_secrets, pack_points, point_size
 
+
+CARDINALITY_BATCH_SIZE = 1024
 CUCKOO_FILTER_CAPACITY_MIN = 1000
 CUCKOO_FILTER_CAPACITY_FRACTION = 0.3
+CUCKOO_FILTER_CAPACITY_GROWTH = 1.1
+CUCKOO_FILTER_BUILD_ATTEMPTS = 10
 CUCKOO_FILTER_BUCKET_SIZE = 6
 CUCKOO_FILTER_FINGERPRINT_SIZE = 4
 DOC_ID_SIZE = 4
 EC_NID_DEFAULT = 415
 ENCODING_DEFAULT = "utf-8"
+PUBLISH_CHUNK_SIZE = 64
+PUBLISH_CHUNKS_PER_PROCESS = 2
+
+PublishedFilter = Union[CuckooFilter, ScalableCuckooFilter, XorFilter]
+FilterType = Type[PublishedFilter]
+
+
+class Publication(tuple):
+    """
+    Published documents: their number, followed by the filter of their keywords and by
+    the corpus-wide filter if there is one.
+
+    The ids of the withdrawn documents are held by the publication itself, in its
+    withdrawn attribute, and serialized next to the number of documents. A plain tuple
+    may be used wherever a publication is read, and has no withdrawn documents.
+    """
+
+    def __new__(cls, n_docs:int, filters:Iterable[PublishedFilter], withdrawn:Iterable[int]):
+        published = super().__new__(cls, (n_docs, *filters))
+        published.withdrawn = set(withdrawn)
+        return published
+
+    def __reduce__(self):
+        return (Publication, (self[0], self[1:], self.withdrawn))
 
 
 def kwd_encode(doc_id:bytes, kwd:bytes) -> bytes:
@@ -30,95 +67,634 @@ def kwd_encode(doc_id:bytes, kwd:bytes) -> bytes:
     return blake2b(doc_id + kwd).digest()
 
 
+def kwd_corpus_encode(kwd:bytes) -> bytes:
+    """
+    Hash an encrypted keyword independently of the document containing it.
+    :param kwd: an encrypted keyword of the corpus
+    :return: a cryptographically secure hash as a binary string
+    """
+    return blake2b(kwd).digest()
+
+
+def cuckoo_capacity(n_items:int) -> int:
+    """
+    Compute the capacity of a cuckoo filter meant to hold a given number of items.
+    :param n_items: number of items to be inserted in the filter
+    :return: capacity of the filter
+    """
+    capacity = n_items * CUCKOO_FILTER_CAPACITY_FRACTION
+
+    # Ensure some minimal capacity on filter
+    return max(CUCKOO_FILTER_CAPACITY_MIN, int(capacity))
+
+
+def filter_capacity(filter_cls:Type[CuckooFilter], n_items:int) -> int:
+    """
+    Compute the capacity of a cuckoo filter of a given implementation meant to hold a given number of items.
+    :param filter_cls: cuckoo filter implementation
+    :param n_items: number of items to be inserted in the filter
+    :return: capacity of the filter
+    """
+    if issubclass(filter_cls, HighLoadCuckooFilter):
+        return filter_cls.capacity_for(n_items, CUCKOO_FILTER_BUCKET_SIZE)
+    return cuckoo_capacity(n_items)
+
+
+def new_scalable_filter(filter_cls:Type[CuckooFilter], n_items:int) -> ScalableCuckooFilter:
+    """
+    Create an empty chain of cuckoo filters sized for a given number of items.
+
+    The first filter holds the items up to the maximal load factor at which the chain
+    stops filling it, so that it does not grow for the expected number of items.
+    :param filter_cls: cuckoo filter implementation
+    :param n_items: number of items expected in the filter, which grows beyond
+    :return: the filter
+    """
+    return ScalableCuckooFilter(
+        capacity=filter_cls.capacity_for(n_items, CUCKOO_FILTER_BUCKET_SIZE),
+        bucket_size=CUCKOO_FILTER_BUCKET_SIZE,
+        fingerprint_size=CUCKOO_FILTER_FINGERPRINT_SIZE,
+        filter_cls=filter_cls
+    )
+
+
+def build_filter(filter_cls:FilterType, kwds_bytes:List[bytes], scalable:bool=False) -> PublishedFilter:
+    """
+    Build a filter holding hashed keywords.
+    :param filter_cls: filter implementation, either a cuckoo filter or a static filter
+    :param kwds_bytes: hashed keywords
+    :param scalable: whether to chain cuckoo filters in a ScalableCuckooFilter growing when full
+    :return: the filter
+    """
+    # A keyword repeated in a document is published once, lookups do not count copies.
+    kwds_bytes = list(dict.fromkeys(kwds_bytes))
+
+    if issubclass(filter_cls, XorFilter):
+        return filter_cls.from_digests(kwds_bytes, fingerprint_size=CUCKOO_FILTER_FINGERPRINT_SIZE)
+
+    if scalable:
+        pub = new_scalable_filter(filter_cls, len(kwds_bytes))
+        pub.insert_many(kwds_bytes)
+        return pub
+
+    # The hashed keywords are at hand, a filter failing to hold them is built again, larger.
+    capacity = filter_capacity(filter_cls, len(kwds_bytes))
+    for attempt in range(CUCKOO_FILTER_BUILD_ATTEMPTS):
+        try:
+            return filter_cls.from_digests(
+                kwds_bytes,
+                capacity=capacity,
+                bucket_size=CUCKOO_FILTER_BUCKET_SIZE,
+                fingerprint_size=CUCKOO_FILTER_FINGERPRINT_SIZE
+            )
+        except CuckooFilterFullException:
+            if attempt == CUCKOO_FILTER_BUILD_ATTEMPTS - 1:
+                raise
+            capacity = int(capacity * CUCKOO_FILTER_CAPACITY_GROWTH) + 1
+
+
+def chunk_docs(docs:Iterable[List[str]], chunk_size:int, doc_id_start:int=0) -> Iterator[Tuple[int, List[List[str]]]]:
+    """
+    Split documents in chunks of consecutive documents.
+    :param docs: an iterable of list of keywords for each document
+    :param chunk_size: maximal number of documents per chunk
+    :param doc_id_start: id of the first document
+    :return: an iterator over the id of the first document of each chunk and the chunk itself
+    """
+    docs = iter(docs)
+    chunk = list(islice(docs, chunk_size))
+    while chunk:
+        yield (doc_id_start, chunk)
+        doc_id_start += len(chunk)
+        chunk = list(islice(docs, chunk_size))
+
+
+def count_docs(docs:Iterable[List[str]]) -> Tuple[Iterator[List[str]], Iterator[int]]:
+    """
+    Count documents as they are read.
+    :param docs: an iterable of list of keywords for each document
+    :return: an iterator over the documents, and a counter whose next value is the number of documents read
+    """
+    # zip() stops before drawing from the counter once the documents are exhausted.
+    doc_ids = count()
+    return ((kwds for kwds, _ in zip(docs, doc_ids)), doc_ids)
+
+
+def encode_docs(group:EcGroup, secret:Bn, doc_id_start:int, docs:List[List[str]], corpus:bool=False, cache:Optional[PointCache]=None) -> Tuple[List[bytes], List[bytes]]:
+    """
+    Encrypt and hash the keywords of consecutive documents for their publication.
+    :param group: elliptic curve group
+    :param secret: secret with which the keywords are encrypted
+    :param doc_id_start: id of the first document
+    :param docs: a list of list of keywords for each document
+    :param corpus: whether to also hash the keywords without their doc ids
+    :param cache: cache of the points to which keywords are hashed
+    :return: the hashes of the keywords with their doc ids, and without their doc ids if requested
+    """
+
+    kwds_docid_bytes = list()
+    kwds_corpus_bytes = list()
+
+    for doc_id, kwds in enumerate(docs, doc_id_start):
+        encoded_doc_id = doc_id.to_bytes(DOC_ID_SIZE, byteorder="big")
+        for kwd in kwds:
+            kwd_pt = hash_to_point(group, kwd.encode(ENCODING_DEFAULT), cache)
+            kwd_enc = secret * kwd_pt
+            kwd_enc_bytes = kwd_enc.export()
+            kwds_docid_bytes.append(kwd_encode(encoded_doc_id, kwd_enc_bytes))
+            if corpus:
+                kwds_corpus_bytes.append(kwd_corpus_encode(kwd_enc_bytes))
+
+    return (kwds_docid_bytes, kwds_corpus_bytes)
+
+
+def encode_docs_worker(curve:int, secret_bytes:bytes, corpus:bool, chunk:Tuple[int, List[List[str]]]) -> Tuple[List[bytes], List[bytes]]:
+    """
+    Encrypt and hash the keywords of consecutive documents for their publication, in a
+    worker process, taking the curve and the secret in binary form like mult_points.
+
+    :param curve: NID of the elliptic curve to use
+    :param secret_bytes: secret in binary form
+    :param corpus: whether to also hash the keywords without their doc ids
+    :param chunk: id of the first document and a list of list of keywords for each document
+    :return: the hashes of the keywords with their doc ids, and without their doc ids if requested
+    """
+
+    doc_id_start, docs = chunk
+    return encode_docs(EcGroup(curve), Bn.from_binary(secret_bytes), doc_id_start, docs, corpus)
+
+
+def encrypt_kwds(group:EcGroup, secret:Bn, kwds:List[str], form:int=POINT_CONVERSION_COMPRESSED, cache:Optional[PointCache]=None) -> List[bytes]:
+    """
+    Hash and encrypt keywords for a query.
+    :param group: elliptic curve group
+    :param secret: secret with which the keywords are encrypted
+    :param kwds: keywords to be queried
+    :param form: form in which the points are exported
+    :param cache: cache of the points to which keywords are hashed
+    :return: the exported encrypted points of the keywords
+    """
+
+    query_enc = list()
+
+    for kwd in kwds:
+        kwd_pt = hash_to_point(group, kwd.encode(ENCODING_DEFAULT), cache)
+        kwd_enc = secret * kwd_pt
+        kwd_enc_bytes = kwd_enc.export(form)
+        query_enc.append(kwd_enc_bytes)
+
+    return query_enc
+
+
+def encrypt_kwds_worker(curve:int, secret_bytes:bytes, form:int, cache:Optional[PointCache], kwds:List[str]) -> List[bytes]:
+    """
+    Hash and encrypt keywords for a query, in a worker process or thread, taking the curve
+    and the secret in binary form like mult_points.
+
+    :param curve: NID of the elliptic curve to use
+    :param secret_bytes: secret in binary form
+    :param form: form in which the points are exported
+    :param cache: cache of the points to which keywords are hashed, None in another process
+    :param kwds: keywords to be queried
+    :return: the exported encrypted points of the keywords
+    """
+
+    return encrypt_kwds(EcGroup(curve), Bn.from_binary(secret_bytes), kwds, form, cache)
+
+
+def decrypt_points(group:EcGroup, secret_inv:Bn, points:Iterable[bytes]) -> List[bytes]:
+    """
+    Decrypt the points of a reply into the keywords to look up in the published filters.
+    :param group: elliptic curve group
+    :param secret_inv: inverse of the secret with which the query was encrypted
+    :param points: exported points of the reply
+    :return: the decrypted keywords
+    """
+
+    # For optimisation the following assumptions are made
+    # - all keywords in the query are different.
+    # - all keywords in the document are different.
+    kwds_dec = list()
+
+    for kwd_h in points:
+        kwd_pt = EcPt.from_binary(kwd_h, group)
+        kwd_pt_dec = secret_inv * kwd_pt
+        kwd_bytes = kwd_pt_dec.export()
+        kwds_dec.append(kwd_bytes)
+
+    return kwds_dec
+
+
+def decrypt_points_worker(curve:int, secret_inv_bytes:bytes, points:List[bytes]) -> List[bytes]:
+    """
+    Decrypt the points of a reply, in a worker process or thread, taking the curve and the
+    secret in binary form like mult_points.
+
+    :param curve: NID of the elliptic curve of the points
+    :param secret_inv_bytes: inverse of the secret of the query in binary form
+    :param points: exported points of the reply
+    :return: the decrypted keywords
+    """
+
+    return decrypt_points(EcGroup(curve), Bn.from_binary(secret_inv_bytes), points)
+
+
+def filter_corpus(published:Tuple[int, PublishedFilter], kwds_dec:List[bytes]) -> List[bytes]:
+    """
+    Discard the decrypted keywords absent from the corpus-wide filter of a publication.
+    :param published: publication, with a corpus-wide filter or not
+    :param kwds_dec: decrypted keywords of a reply
+    :return: the decrypted keywords which may match a document
+    """
+
+    published_corpus = published[2] if len(published) > 2 else None
+
+    # Keywords absent from the whole corpus cannot match any document.
+    if published_corpus is not None and kwds_dec:
+        in_corpus = published_corpus.contains_many([kwd_corpus_encode(kwd_dec) for kwd_dec in kwds_dec])
+        kwds_dec = [kwd_dec for kwd_dec, found in zip(kwds_dec, in_corpus) if found]
+
+    return kwds_dec
+
+
+def withdrawn_docs(published:Tuple[int, PublishedFilter]) -> Set[int]:
+    """
+    Get the ids of the documents withdrawn from a publication.
+    :param published: publication, or plain tuple without withdrawn documents
+    :return: the ids of the withdrawn documents
+    """
+
+    return published.withdrawn if isinstance(published, Publication) else set()
+
+
+def count_matches(published_data:PublishedFilter, kwds_dec:List[bytes], doc_id_start:int, doc_id_end:int) -> List[int]:
+    """
+    Count the decrypted keywords published for each document of a range of doc ids.
+    :param published_data: cuckoo filter containing the published keywords
+    :param kwds_dec: decrypted keywords of a reply
+    :param doc_id_start: first doc id of the range
+    :param doc_id_end: doc id following the range
+    :return: list of cardinalities for each document of the range
+    """
+
+    return count_matches_many(published_data, [kwds_dec], doc_id_start, doc_id_end)[0]
+
+
+def count_matches_many(published_data:PublishedFilter, kwds_decs:List[List[bytes]], doc_id_start:int, doc_id_end:int) -> List[List[int]]:
+    """
+    Count the decrypted keywords of several replies published for each document of a range of doc ids.
+
+    Each doc id is encoded once, and keywords shared by several replies are probed once.
+    :param published_data: cuckoo filter containing the published keywords
+    :param kwds_decs: decrypted keywords of each reply
+    :param doc_id_start: first doc id of the range
+    :param doc_id_end: doc id following the range
+    :return: list of cardinalities for each document of the range, for each reply
+    """
+
+    kwds_all = list(dict.fromkeys(kwd_dec for kwds_dec in kwds_decs for kwd_dec in kwds_dec))
+    columns = {kwd_dec: column for column, kwd_dec in enumerate(kwds_all)}
+
+    # The filter is probed with all the keywords of the range at once.
+    kwds_docid_bytes = list()
+    for doc_id in range(doc_id_start, doc_id_end):
+        encoded_doc_id = doc_id.to_bytes(DOC_ID_SIZE, byteorder="big")
+        for kwd_dec in kwds_all:
+            kwds_docid_bytes.append(kwd_encode(encoded_doc_id, kwd_dec))
+
+    matches = published_data.contains_many(kwds_docid_bytes).reshape(doc_id_end - doc_id_start, len(kwds_all))
+    return [matches[:, [columns[kwd_dec] for kwd_dec in kwds_dec]].sum(axis=1).tolist() for kwds_dec in kwds_decs]
+
+
+def count_matches_above(published_data:PublishedFilter, kwds_dec:List[bytes], doc_id_start:int, doc_id_end:int, threshold:int) -> Dict[int, int]:
+    """
+    Count the decrypted keywords published for the documents of a range of doc ids which
+    match at least a given number of them.
+
+    The keywords are probed one by one, only for the documents which can still reach the
+    threshold with the keywords left to probe.
+    :param published_data: cuckoo filter containing the published keywords
+    :param kwds_dec: decrypted keywords of a reply
+    :param doc_id_start: first doc id of the range
+    :param doc_id_end: doc id following the range
+    :param threshold: minimal number of matching keywords, at least 1
+    :return: cardinalities of the documents reaching the threshold, by doc id
+    """
+
+    doc_ids = np.arange(doc_id_start, doc_id_end)
+    encoded_doc_ids = [doc_id.to_bytes(DOC_ID_SIZE, byteorder="big") for doc_id in range(doc_id_start, doc_id_end)]
+    counts = np.zeros(len(doc_ids), dtype=np.int64)
+
+    for k, kwd_dec in enumerate(kwds_dec):
+        reachable = counts + (len(kwds_dec) - k) >= threshold
+        doc_ids, counts = doc_ids[reachable], counts[reachable]
+        if not len(doc_ids):
+            return {}
+
+        kwds_docid_bytes = [kwd_encode(encoded_doc_ids[doc_id - doc_id_start], kwd_dec) for doc_id in doc_ids.tolist()]
+        counts += published_data.contains_many(kwds_docid_bytes)
+
+    matching = counts >= threshold
+    return dict(zip(doc_ids[matching].tolist(), counts[matching].tolist()))
+
+
+_count_matches_state = None
+
+
+def count_matches_init(published_data:PublishedFilter, kwds_decs:Optional[List[List[bytes]]]=None):
+    """
+    Initialize a worker process of a pool probing a filter, so the filter and the keywords
+    are handed once to each process rather than with every batch of documents.
+    :param published_data: cuckoo filter containing the published keywords
+    :param kwds_decs: decrypted keywords of each reply, None for a pool serving many replies
+    """
+
+    global _count_matches_state
+    _count_matches_state = (published_data, kwds_decs)
+
+
+def count_matches_worker(batch:Tuple[int, int], kwds_decs:Optional[List[List[bytes]]]=None) -> List[List[int]]:
+    """
+    Count the decrypted keywords of each reply published for each document of a range of
+    doc ids, in a worker process initialized by count_matches_init.
+    :param batch: first doc id and doc id following the last one of the range
+    :param kwds_decs: decrypted keywords of each reply, the ones handed to count_matches_init if None
+    :return: list of the counts of each document, for each reply
+    """
+
+    published_data, init_kwds_decs = _count_matches_state
+    return count_matches_many(published_data, kwds_decs if kwds_decs is not None else init_kwds_decs, batch[0], batch[1])
+
+
 class MSPSIClient:
     """
     Client for a multi set PSI
     """
 
-    def __init__(self, curve:int=EC_NID_DEFAULT):
+    def __init__(self, curve:int=EC_NID_DEFAULT, cache:Optional[PointCache]=None, point_form:int=POINT_CONVERSION_COMPRESSED):
         """
         Constructor for the client of a multi set PSI
 
         :param curve: NID of the elliptic curve to use
+        :param cache: cache of the points to which keywords are hashed
+        :param point_form: form in which the points of the queries are exported, POINT_CONVERSION_COMPRESSED or POINT_CONVERSION_UNCOMPRESSED
         """
 
         self.group = EcGroup(curve)
+        self.cache = cache
+        self.point_form = check_form(point_form)
+        self.pools = dict()
+
+
+    def open_pool(self, published:Tuple[int, PublishedFilter], processes:Optional[int]=None):
+        """
+        Open a pool of processes probing the filter of a publication.
+
+        Each process is handed the filter once, and the pool serves every computation of
+        cardinalities of the publication, whatever the number of processes requested by
+        the call, until it is closed.
+
+        :param published: publication to be probed
+        :param processes: number of processes of the pool, None for one per CPU
+        """
+
+        published_data = published[1]
+        # The filter is kept with its pool, so that its id is not reused while the pool is open.
+        if id(published_data) in self.pools:
+            raise ValueError("A pool is already open for the publication.")
+
+        pool = Pool(processes, initializer=count_matches_init, initargs=(published_data,))
+        self.pools[id(published_data)] = (published_data, pool)
 
 
-    def query(self, kwds:List[str]) -> Tuple[Bn, List[bytes]]:
+    def close_pool(self, published:Tuple[int, PublishedFilter]):
+        """
+        Shut down the pool of processes probing the filter of a publication.
+
+        :param published: publication whose pool was opened with open_pool
+        """
+
+        if id(published[1]) not in self.pools:
+            raise ValueError("No pool is open for the publication.")
+
+        _, pool = self.pools.pop(id(published[1]))
+        pool.close()
+        pool.join()
+
+
+    def close(self):
+        """
+        Shut down the pools of processes of every publication.
+        """
+
+        for _, pool in self.pools.values():
+            pool.close()
+            pool.join()
+        self.pools.clear()
+
+
+    def query(self, kwds:List[str], packed:bool=False) -> Tuple[Bn, Points]:
         """
         Generate a query from the keywords.
 
-        :param kwds_ms: Multi set of keywords to be queried
+        :param kwds: Multi set of keywords to be queried
+        :param packed: whether to pack the points of the query in a single buffer, which the reply then is too
         :return: a secret to generate the query and the query itself
         """
 
         secret = self.group.order().random()
+        query_enc = encrypt_kwds(self.group, secret, kwds, self.point_form, self.cache)
 
-        query_enc = list()
-
-        for kwd in kwds:
-            kwd_pt = self.group.hash_to_point(kwd.encode(ENCODING_DEFAULT))
-            kwd_enc = secret * kwd_pt
-            kwd_enc_bytes = kwd_enc.export()
-            query_enc.append(kwd_enc_bytes)
+        if packed:
+            return (secret, pack_points(query_enc, len(query_enc), point_size(self.group, self.point_form), self.point_form))
 
         return (secret, query_enc)
 
 
-    def compute_cardinalities(self, secret:Bn, reply:List[bytes], published:Tuple[int, CuckooFilter]) -> List[int]:
+    def decrypt_reply(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter]) -> List[bytes]:
+        """
+        Decrypt the keywords of a reply, discarding the ones absent from the corpus-wide
+        filter of the publication if it has one.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :return: the decrypted keywords which may match a document
+        """
+
+        secret_inv = secret.mod_inverse(self.group.order())
+        kwds_dec = decrypt_points(self.group, secret_inv, iter_points(reply))
+
+        return filter_corpus(published, kwds_dec)
+
+
+    def compute_cardinalities(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter], processes:Optional[int]=1) -> List[int]:
         """
         Compute the cardinalyty of the intersection of sets between the reply to a query
         and the list of lists of points published by the server.
 
+        With more than one process, ranges of doc ids are spread over a process pool. The
+        pool opened with open_pool for the publication, if any, is used instead.
+
         :param secret: secret with which the query was encrypted
         :param reply: reply from the server
         :param published: list of lists of point published by the server
+        :param processes: number of processes probing the filter, None for one per CPU
         :return: list of cardinalities for the intersection between the reply and each published list of points.
         """
 
+        kwds_dec = self.decrypt_reply(secret, reply, published)
+
+        if not kwds_dec:
+            return [0] * published[0]
+
+        return self._count_matches_many(published, [kwds_dec], processes)[0]
+
+
+    def compute_cardinalities_many(self, secrets:List[Bn], replies:List[Points], published:Tuple[int, PublishedFilter], processes:Optional[int]=1) -> List[List[int]]:
+        """
+        Compute the cardinalities for several replies to queries against the same publication.
+
+        The doc ids are walked once for all the replies: each doc id is encoded once for
+        every reply, and keywords shared by several replies are probed once. The pool
+        opened with open_pool for the publication, if any, probes the documents.
+
+        :param secrets: secrets with which each query was encrypted
+        :param replies: replies from the server, in the order of the secrets
+        :param published: list of lists of point published by the server
+        :param processes: number of processes probing the filter, None for one per CPU
+        :return: list of cardinalities for each document, for each reply
+        """
+
+        kwds_decs = [self.decrypt_reply(secret, reply, published) for secret, reply in zip(secrets, replies)]
+
+        return self._count_matches_many(published, kwds_decs, processes)
+
+
+    def _count_matches_many(self, published:Tuple[int, PublishedFilter], kwds_decs:List[List[bytes]], processes:Optional[int]) -> List[List[int]]:
         n_docs = published[0]
         published_data = published[1]
-        secret_inv = secret.mod_inverse(self.group.order())
-        cardinalities = []
-
-        # For optimisation the following assumptions are made
-        # - all keywords in the query are different.
-        # - all keywords in the document are different.
-        kwds_dec = list()
-
-        for kwd_h in reply:
-            kwd_pt = EcPt.from_binary(kwd_h, self.group)
-            kwd_pt_dec = secret_inv * kwd_pt
-            kwd_bytes = kwd_pt_dec.export()
-            kwds_dec.append(kwd_bytes)
-
-        for doc_id in range(n_docs):
-            n_matches = 0
-            encoded_doc_id = doc_id.to_bytes(DOC_ID_SIZE, byteorder="big")
-            for kwd_dec in kwds_dec:
-                kwd_docid_bytes = kwd_encode(encoded_doc_id, kwd_dec)
-                if published_data.contains(kwd_docid_bytes):
-                    n_matches += 1
-            cardinalities.append(n_matches)
+        cardinalities = [list() for _ in kwds_decs]
+
+        batches = [(batch_start, min(batch_start + CARDINALITY_BATCH_SIZE, n_docs)) for batch_start in range(0, n_docs, CARDINALITY_BATCH_SIZE)]
+
+        if id(published_data) in self.pools:
+            # The workers already hold the filter, only the keywords go with each batch.
+            _, pool = self.pools[id(published_data)]
+            for batch_cardinalities in pool.imap(partial(count_matches_worker, kwds_decs=kwds_decs), batches):
+                for query_cardinalities, batch_query_cardinalities in zip(cardinalities, batch_cardinalities):
+                    query_cardinalities.extend(batch_query_cardinalities)
+        elif processes == 1:
+            for doc_id_start, doc_id_end in batches:
+                batch_cardinalities = count_matches_many(published_data, kwds_decs, doc_id_start, doc_id_end)
+                for query_cardinalities, batch_query_cardinalities in zip(cardinalities, batch_cardinalities):
+                    query_cardinalities.extend(batch_query_cardinalities)
+        else:
+            # The filter and the keywords are handed once to each worker rather than with every batch.
+            with Pool(processes, initializer=count_matches_init, initargs=(published_data, kwds_decs)) as pool:
+                for batch_cardinalities in pool.imap(count_matches_worker, batches):
+                    for query_cardinalities, batch_query_cardinalities in zip(cardinalities, batch_cardinalities):
+                        query_cardinalities.extend(batch_query_cardinalities)
+
+        # Keywords of withdrawn documents left in the filter, if any, must not be counted.
+        for doc_id in withdrawn_docs(published):
+            for query_cardinalities in cardinalities:
+                query_cardinalities[doc_id] = 0
 
         return cardinalities
 
 
+    def compute_cardinalities_threshold(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter], threshold:int) -> Dict[int, int]:
+        """
+        Compute the cardinalities of the documents matching at least a given number of
+        keywords of the reply.
+
+        A document stops being probed as soon as it cannot reach the threshold anymore.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :param threshold: minimal cardinality of the returned documents, at least 1
+        :return: cardinalities of the matching documents, by doc id
+        """
+
+        if threshold < 1:
+            raise ValueError("The threshold must be at least 1.")
+
+        n_docs = published[0]
+        kwds_dec = self.decrypt_reply(secret, reply, published)
+        withdrawn = withdrawn_docs(published)
+        cardinalities = dict()
+
+        for doc_id_start in range(0, n_docs, CARDINALITY_BATCH_SIZE):
+            doc_id_end = min(doc_id_start + CARDINALITY_BATCH_SIZE, n_docs)
+            for doc_id, cardinality in count_matches_above(published[1], kwds_dec, doc_id_start, doc_id_end, threshold).items():
+                if doc_id not in withdrawn:
+                    cardinalities[doc_id] = cardinality
+
+        return cardinalities
+
+
+    def compute_cardinalities_top_k(self, secret:Bn, reply:Points, published:Tuple[int, PublishedFilter], k:int) -> Dict[int, int]:
+        """
+        Compute the cardinalities of the k documents matching the most keywords of the reply.
+
+        Documents matching no keyword are never returned. A document stops being probed as
+        soon as it cannot beat the current k-th best document, which is kept on ties, so
+        the documents with the lowest doc ids are preferred among equal cardinalities.
+
+        :param secret: secret with which the query was encrypted
+        :param reply: reply from the server
+        :param published: list of lists of point published by the server
+        :param k: maximal number of returned documents
+        :return: cardinalities of the best documents, by doc id, from the best one
+        """
+
+        if k < 1:
+            raise ValueError("At least one document must be requested.")
+
+        n_docs = published[0]
+        kwds_dec = self.decrypt_reply(secret, reply, published)
+        withdrawn = withdrawn_docs(published)
+        best = list()
+
+        for doc_id_start in range(0, n_docs, CARDINALITY_BATCH_SIZE):
+            doc_id_end = min(doc_id_start + CARDINALITY_BATCH_SIZE, n_docs)
+            threshold = best[0][0] + 1 if len(best) == k else 1
+            for doc_id, cardinality in count_matches_above(published[1], kwds_dec, doc_id_start, doc_id_end, threshold).items():
+                if doc_id in withdrawn:
+                    continue
+                # Among equal cardinalities, the highest doc id is the first one evicted.
+                entry = (cardinality, -doc_id)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+
+        return {-doc_id: cardinality for cardinality, doc_id in sorted(best, reverse=True)}
+
+
 
 class MSPSIServer:
     """
     Server for a multi set PSI
     """
 
-    def __init__(self, curve:int=EC_NID_DEFAULT):
+    def __init__(self, curve:int=EC_NID_DEFAULT, cache:Optional[PointCache]=None, point_form:Optional[int]=None, reply_cache:Optional[ReplyCache]=None):
         """
         Constructor for the server of a multi set PSI
 
         :param curve: NID of the elliptic curve to use.
+        :param cache: cache of the points to which keywords are hashed
+        :param point_form: form in which the points of the replies are exported, the form of each query if None
+        :param reply_cache: cache of the replies to query points, None to compute every reply, see ReplyCache for its privacy implications
         """
 
         self.group = EcGroup(curve)
+        self.cache = cache
+        self.point_form = check_form(point_form) if point_form is not None else None
+        self.reply_cache = reply_cache
+        self.publications = dict()
 
 
     @staticmethod
@@ -127,50 +703,264 @@ class MSPSIServer:
         Compute the size of a given published data.
         :param published: published data
         """
-        published_data = published[1]
-        capacity = published_data.capacity
-        bucket_size = published_data.bucket_size
-        return capacity * bucket_size
+        length = 0
+        for published_data in published[1:]:
+            if isinstance(published_data, ScalableCuckooFilter):
+                length += published_data.slots
+                continue
+            capacity = published_data.capacity
+            bucket_size = published_data.bucket_size
+            length += capacity * bucket_size
+        return length
+
+
+    def encode_chunks(self, secret:Bn, docs:Iterable[List[str]], corpus:bool=False, processes:Optional[int]=1, doc_id_start:int=0) -> Iterator[Tuple[List[bytes], List[bytes]]]:
+        """
+        Encrypt and hash the keywords of documents for their publication, chunk by chunk.
 
+        With more than one process, the chunks are spread over a process pool and the
+        results are still returned in the order of the documents. Only a few chunks per
+        process are read ahead from the documents. The cache of hashed keywords is only
+        used by the serial path.
 
-    def publish(self, docs:List[List[str]]) -> Tuple[Bn, Tuple[int, CuckooFilter]]:
+        :param secret: secret with which the keywords are encrypted
+        :param docs: an iterable of list of keywords for each document
+        :param corpus: whether to also hash the keywords without their doc ids
+        :param processes: number of worker processes, None for one per CPU
+        :param doc_id_start: id of the first document
+        :return: an iterator over the results of encode_docs() for each chunk
+        """
+
+        chunks = chunk_docs(docs, PUBLISH_CHUNK_SIZE, doc_id_start)
+
+        if processes == 1:
+            for doc_id_start, chunk in chunks:
+                yield encode_docs(self.group, secret, doc_id_start, chunk, corpus, self.cache)
+            return
+
+        worker = partial(encode_docs_worker, self.group.nid(), secret.binary(), corpus)
+        # Pool.imap() would read all the chunks at once, they are handed over window by window.
+        window = PUBLISH_CHUNKS_PER_PROCESS * (processes or cpu_count())
+        with Pool(processes) as pool:
+            batch = list(islice(chunks, window))
+            while batch:
+                results = pool.imap(worker, batch)
+                batch = list(islice(chunks, window))
+                yield from results
+
+
+    def publish(self, docs:List[List[str]], filter_cls:FilterType=HighLoadCuckooFilter, corpus_filter:bool=False, processes:Optional[int]=1, scalable:bool=False) -> Tuple[Bn, Publication]:
         """
         Generate a list of lists of points on the EC corresponding to a document's keywords.
 
+        When requested, a second cuckoo filter holding the encrypted keywords of the whole
+        corpus, without their doc ids, is appended to the publication. Clients use it to
+        discard query keywords appearing in no document before probing each document.
+
+        In scalable mode, cuckoo filters are ScalableCuckooFilter chains which grow instead
+        of raising CuckooFilterFullException, so the publication always completes. The
+        number of growths is given by their resizes attribute and their filling by their
+        load_factor attribute.
+
         :param docs: a list of list of keywords for each document.
+        :param filter_cls: filter implementation storing the published keywords, a cuckoo filter or the static XorFilter.
+        :param corpus_filter: whether to also publish the corpus-wide filter.
+        :param processes: number of processes encrypting the keywords, None for one per CPU.
+        :param scalable: whether cuckoo filters grow when full, ignored for static filters.
         :return: a secret with wich the keywords were encrypted and a cuckoo filter containing the encrypted keywords.
         """
 
-        cuckoo_capacity = 0
-        for kwds in docs:
-            cuckoo_capacity += len(kwds)
+        secret = self.group.order().random()
+
+        # The filters are built in bulk from all the hashed keywords.
+        kwds_docid_bytes_all = list()
+        kwds_corpus_bytes = set()
+
+        for kwds_docid_bytes, kwds_chunk_bytes in self.encode_chunks(secret, docs, corpus_filter, processes):
+            kwds_docid_bytes_all.extend(kwds_docid_bytes)
+            kwds_corpus_bytes.update(kwds_chunk_bytes)
+
+        pub = build_filter(filter_cls, kwds_docid_bytes_all, scalable)
+
+        if not corpus_filter:
+            return (secret, Publication(len(docs), (pub,), ()))
 
-        cuckoo_capacity *= CUCKOO_FILTER_CAPACITY_FRACTION
+        corpus_pub = build_filter(filter_cls, list(kwds_corpus_bytes), scalable)
 
-        # Ensure some minimal capacity on filter
-        cuckoo_capacity = max(CUCKOO_FILTER_CAPACITY_MIN, int(cuckoo_capacity))
+        return (secret, Publication(len(docs), (pub, corpus_pub), ()))
+
+
+    def publish_stream(self, docs:Iterable[List[str]], n_kwds:int, filter_cls:Type[CuckooFilter]=HighLoadCuckooFilter, corpus_filter:bool=False, processes:Optional[int]=1) -> Tuple[Bn, Publication]:
+        """
+        Publish documents read from any iterable, such as a generator, chunk by chunk.
+
+        Each chunk of documents is encrypted and inserted into the filter before the next
+        one is read, so the documents are never all held in memory. The filters are
+        ScalableCuckooFilter chains sized for the expected number of keywords, which grow
+        if it is exceeded. Each growth adds a filter which every lookup of the clients
+        probes, so the number of keywords should rather be overestimated. The
+        corpus-wide filter still requires keeping the hashes of the distinct keywords of
+        the corpus until the end.
+
+        :param docs: an iterable of list of keywords for each document.
+        :param n_kwds: exact or estimated number of keywords in all the documents.
+        :param filter_cls: cuckoo filter implementation of the filters of the chains.
+        :param corpus_filter: whether to also publish the corpus-wide filter.
+        :param processes: number of processes encrypting the keywords, None for one per CPU.
+        :return: a secret with wich the keywords were encrypted and a cuckoo filter containing the encrypted keywords.
+        """
+
+        if issubclass(filter_cls, XorFilter):
+            raise ValueError("Static filters cannot be built from a stream of documents.")
 
         secret = self.group.order().random()
 
-        pub = CuckooFilter(
-            capacity=cuckoo_capacity,
-            bucket_size=CUCKOO_FILTER_BUCKET_SIZE,
-            fingerprint_size=CUCKOO_FILTER_FINGERPRINT_SIZE
-        )
+        docs, doc_ids = count_docs(docs)
+
+        pub = new_scalable_filter(filter_cls, n_kwds)
+        kwds_corpus_bytes = set()
+
+        for kwds_docid_bytes, kwds_chunk_bytes in self.encode_chunks(secret, docs, corpus_filter, processes):
+            pub.insert_many(list(dict.fromkeys(kwds_docid_bytes)))
+            kwds_corpus_bytes.update(kwds_chunk_bytes)
+
+        n_docs = next(doc_ids)
+
+        if not corpus_filter:
+            return (secret, Publication(n_docs, (pub,), ()))
+
+        corpus_pub = build_filter(filter_cls, list(kwds_corpus_bytes), scalable=True)
+
+        return (secret, Publication(n_docs, (pub, corpus_pub), ()))
+
+
+    def append(self, secret:Bn, published:Tuple[int, PublishedFilter], docs:Iterable[List[str]], filter_cls:Type[CuckooFilter]=HighLoadCuckooFilter, processes:Optional[int]=1) -> Publication:
+        """
+        Append new documents to an existing publication.
+
+        Only the keywords of the new documents are encrypted, with the secret of the
+        publication, and their doc ids follow the documents already published. Each
+        filter is turned into a ScalableCuckooFilter chain, if it is not one already, so
+        it grows when needed; the filters of the publication are updated in place. Only
+        the keywords of the new documents absent from the corpus-wide filter are added to
+        it, so that it does not grow with each append of common keywords. A keyword only
+        found because of a false positive is left out, which merely makes the clients
+        probe the documents for it.
+
+        The filters receiving the new keywords must be writable: semi-sorted filters and
+        filters mapped in memory by publication.load_mapped are rejected with a ValueError
+        before anything is inserted.
+
+        :param secret: secret with which the keywords of the publication were encrypted.
+        :param published: publication as returned by publish.
+        :param docs: an iterable of list of keywords for each new document.
+        :param filter_cls: cuckoo filter implementation of the filters added to the chains.
+        :param processes: number of processes encrypting the keywords, None for one per CPU.
+        :return: the publication holding both the published and the new documents.
+        """
+
+        for published_data in published[1:]:
+            self._check_append_filter(published_data)
+
+        filters = [self._append_filter(published_data, filter_cls) for published_data in published[1:]]
+        pub = filters[0]
+        corpus_pub = filters[1] if len(filters) > 1 else None
+
+        docs, doc_ids = count_docs(docs)
+
+        for kwds_docid_bytes, kwds_chunk_bytes in self.encode_chunks(secret, docs, corpus_pub is not None, processes, published[0]):
+            pub.insert_many(list(dict.fromkeys(kwds_docid_bytes)))
+            kwds_corpus_bytes = list(set(kwds_chunk_bytes))
+            if corpus_pub is not None and kwds_corpus_bytes:
+                in_corpus = corpus_pub.contains_many(kwds_corpus_bytes)
+                corpus_pub.insert_many([kwd_bytes for kwd_bytes, found in zip(kwds_corpus_bytes, in_corpus) if not found])
+
+        return Publication(published[0] + next(doc_ids), filters, withdrawn_docs(published))
+
+
+    def unpublish(self, secret:Bn, published:Tuple[int, PublishedFilter], doc_id:int, kwds:List[str]) -> int:
+        """
+        Withdraw the keywords of a published document.
+
+        The hashes of the keywords of the document are computed again and deleted from
+        the filter, at a cost proportional to the size of the document. The keywords
+        must be exactly the ones published for the document, otherwise the fingerprints
+        of other keywords could be deleted. Static filters, including the ones starting
+        a chain after an append, cannot delete keywords: a document they hold cannot be
+        withdrawn, and the remaining documents must be published again instead. The
+        filter is updated in place, so the change can be synchronized with a delta like
+        any other update.
+
+        The doc id of the document is left as a tombstone: it keeps its place, so that
+        the ids of the other documents, which are part of their hashes, do not change.
+        It is added to the withdrawn attribute of the publication, and the clients give
+        it a cardinality of 0 whatever keywords are left. Tombstones are only reclaimed
+        by a new publication of the remaining documents. The corpus-wide filter is left
+        as is, since its keywords may belong to other documents, and only makes the
+        clients probe the documents for keywords which might have been removed.
+
+        :param secret: secret with which the keywords of the publication were encrypted.
+        :param published: publication as returned by publish, updated in place.
+        :param doc_id: id of the document to withdraw.
+        :param kwds: keywords of the document.
+        :return: the number of keywords deleted from the filter.
+        """
+
+        if not isinstance(published, Publication):
+            raise ValueError("Documents can only be withdrawn from a Publication.")
+
+        pub = published[1]
+        withdrawn = published.withdrawn
+
+        if not 0 <= doc_id < published[0]:
+            raise ValueError("No document with id {} in the publication.".format(doc_id))
+        if doc_id in withdrawn:
+            raise ValueError("The document with id {} was already withdrawn.".format(doc_id))
+
+        # Keywords repeated in the document were published once.
+        kwds_docid_bytes, _ = encode_docs(self.group, secret, doc_id, [kwds], cache=self.cache)
+        kwds_docid_bytes = list(dict.fromkeys(kwds_docid_bytes))
+
+        # The document is checked before anything is deleted, so a failure leaves the filter as is.
+        static_filters = [f for f in (pub.filters if isinstance(pub, ScalableCuckooFilter) else [pub]) if isinstance(f, XorFilter)]
+        if kwds_docid_bytes and any(f.contains_many(kwds_docid_bytes).any() for f in static_filters):
+            raise ValueError("The document with id {} is held by a static filter, the documents must be published again.".format(doc_id))
 
-        for doc_id, kwds in enumerate(docs):
-            encoded_doc_id = doc_id.to_bytes(DOC_ID_SIZE, byteorder="big")
-            for kwd in kwds:
-                kwd_pt = self.group.hash_to_point(kwd.encode(ENCODING_DEFAULT))
-                kwd_enc = secret * kwd_pt
-                kwd_enc_bytes = kwd_enc.export()
-                kwd_docid_bytes = kwd_encode(encoded_doc_id, kwd_enc_bytes)
-                pub.insert(kwd_docid_bytes)
+        n_deleted = 0
+        for kwd_docid_bytes in kwds_docid_bytes:
+            if pub.delete(kwd_docid_bytes):
+                n_deleted += 1
 
-        return (secret, (len(docs), pub))
+        withdrawn.add(doc_id)
 
+        return n_deleted
 
-    def reply(self, secret:Bn, query:List[bytes]) -> List[Bn]:
+
+    @staticmethod
+    def _check_append_filter(published_data:PublishedFilter):
+        # Only the last filter of a chain receives items, static filters are followed by new ones.
+        if isinstance(published_data, ScalableCuckooFilter):
+            published_data = published_data.filters[-1]
+        if not isinstance(published_data, CompactCuckooFilter):
+            return
+        if isinstance(published_data.table, SemiSortedTable):
+            raise ValueError("Documents cannot be appended to semi-sorted filters, which are read-only.")
+        if not published_data.table.flags.writeable:
+            raise ValueError("Documents cannot be appended to filters mapped in memory, the publication is loaded with publication.load instead.")
+
+
+    @staticmethod
+    def _append_filter(published_data:PublishedFilter, filter_cls:Type[CuckooFilter]) -> ScalableCuckooFilter:
+        if isinstance(published_data, ScalableCuckooFilter):
+            published_data.filter_cls = filter_cls
+            return published_data
+        if isinstance(published_data, XorFilter):
+            # Static filters cannot receive items, new items go to the following filters.
+            return ScalableCuckooFilter.from_filters([published_data] + new_scalable_filter(filter_cls, len(published_data)).filters, filter_cls=filter_cls)
+        return ScalableCuckooFilter.from_filters([published_data], filter_cls=filter_cls)
+
+
+    def reply(self, secret:Bn, query:Points) -> Points:
         """
         Compute a reply to a query.
 
@@ -179,12 +969,62 @@ class MSPSIServer:
         :return: reply to the query
         """
 
-        reply = list()
+        return mult_query(self.group, secret, query, self.point_form, self.reply_cache)
 
-        for kwd_h in query:
-            kwd_pt = EcPt.from_binary(kwd_h, self.group)
-            kwd_enc = secret * kwd_pt
-            kwd_enc_bytes = kwd_enc.export()
-            reply.append(kwd_enc_bytes)
 
-        return reply
+    def reply_many(self, secret:Bn, queries:List[Points], executor:Optional[Executor]=None) -> List[Points]:
+        """
+        Compute the replies to many queries.
+
+        Points occurring several times in the batch are multiplied only once.
+
+        :param secret: secret with which the keywords were encrypted during the publication
+        :param queries: queries to be answered
+        :param executor: thread or process pool on which to run the point multiplications
+        :return: replies to the queries, in the order of the queries
+        """
+
+        return mult_queries(self.group, secret, queries, executor, self.point_form, self.reply_cache)
+
+
+    def register(self, publication_id:Hashable, secret:Bn):
+        """
+        Register a publication, so that reply_all answers queries against it.
+
+        :param publication_id: identifier of the publication
+        :param secret: secret with which the keywords were encrypted during the publication
+        """
+
+        if publication_id in self.publications:
+            raise ValueError("Publication {!r} is already registered.".format(publication_id))
+
+        self.publications[publication_id] = secret
+
+
+    def unregister(self, publication_id:Hashable):
+        """
+        Stop answering queries against a registered publication.
+
+        :param publication_id: identifier of the publication
+        """
+
+        if publication_id not in self.publications:
+            raise ValueError("No publication {!r} is registered.".format(publication_id))
+
+        secret = self.publications.pop(publication_id)
+        if self.reply_cache is not None:
+            self.reply_cache.clear(secret)
+
+
+    def reply_all(self, query:Points) -> Dict[Hashable, Points]:
+        """
+        Compute the replies to a query for every registered publication.
+
+        The points of the query are decoded once, then multiplied by the secret of each
+        publication.
+
+        :param query: query to be answered
+        :return: replies to the query, by publication identifier, in the order of registration
+        """
+
+        return mult_query_secrets(self.group, self.publications, query, self.point_form, self.reply_cache)
@@ -0,0 +1,329 @@
+"""
+Batched operations on points shared by the PSI protocols
+
+Queries and replies are lists of exported points, or packed buffers holding the exported
+points back to back after a header giving the form and the size of a point and the number
+of points. A packed buffer can be sent as is and is read through memoryview slices.
+
+Points are exported compressed or uncompressed. Uncompressed points are about twice as
+large, but decoding them does not take a modular square root, which is a sizeable part
+of the cost of a reply on small curves. A reply is exported in the form of its query
+unless the server enforces one.
+"""
+
+import struct
+from concurrent.futures import Executor
+from functools import partial
+from itertools import chain
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from petlib.bn import Bn
+from petlib.ec import EcGroup, EcPt, POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED
+
+from .cache import ReplyCache
+
+
+MULT_CHUNK_SIZE = 256
+PACKED_HEADER = struct.Struct(">BHI")
+POINT_FORMS = (POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED)
+
+Points = Union[List[bytes], bytes, bytearray, memoryview]
+
+
+def check_form(form:int) -> int:
+    """
+    Check that a point form is supported.
+
+    :param form: POINT_CONVERSION_COMPRESSED or POINT_CONVERSION_UNCOMPRESSED
+    :return: the form
+    """
+
+    if form not in POINT_FORMS:
+        raise ValueError("Unsupported point form: {}".format(form))
+
+    return form
+
+
+def point_size(group:EcGroup, form:int=POINT_CONVERSION_COMPRESSED) -> int:
+    """
+    Get the size of the exported points of a curve.
+
+    :param group: elliptic curve group
+    :param form: form in which the points are exported
+    :return: size in bytes of an exported point
+    """
+
+    return len(group.generator().export(check_form(form)))
+
+
+def is_packed(points:Points) -> bool:
+    """
+    Tell whether points are a packed buffer rather than a list of exported points.
+
+    :param points: query or reply
+    :return: True for a packed buffer
+    """
+
+    return isinstance(points, (bytes, bytearray, memoryview))
+
+
+def packed_shape(data:Union[bytes, bytearray, memoryview]) -> Tuple[int, int, int]:
+    """
+    Read the header of a packed buffer of points.
+
+    :param data: packed buffer
+    :return: the form and the size of a point, and the number of points
+    """
+
+    if len(data) < PACKED_HEADER.size:
+        raise ValueError("Truncated packed points.")
+
+    form, size, n_points = PACKED_HEADER.unpack_from(data)
+    check_form(form)
+    if len(data) != PACKED_HEADER.size + size * n_points:
+        raise ValueError("Packed points of {} bytes expected, got {} bytes.".format(PACKED_HEADER.size + size * n_points, len(data)))
+
+    return (form, size, n_points)
+
+
+def points_form(points:Points) -> int:
+    """
+    Get the form of the points of a query or of a reply.
+
+    :param points: query or reply
+    :return: the form recorded in a packed buffer, or the form of the first point of a list
+    """
+
+    if is_packed(points):
+        return packed_shape(points)[0]
+    if points and points[0][0] == POINT_CONVERSION_UNCOMPRESSED:
+        return POINT_CONVERSION_UNCOMPRESSED
+    return POINT_CONVERSION_COMPRESSED
+
+
+def pack_points(points:Iterable[bytes], n_points:int, size:int, form:int=POINT_CONVERSION_COMPRESSED) -> bytearray:
+    """
+    Write exported points to a packed buffer.
+
+    :param points: exported points, which may be generated as they are written
+    :param n_points: number of points
+    :param size: size in bytes of a point
+    :param form: form in which the points are exported
+    :return: the packed buffer
+    """
+
+    data = bytearray(PACKED_HEADER.size + size * n_points)
+    PACKED_HEADER.pack_into(data, 0, check_form(form), size, n_points)
+
+    offset = PACKED_HEADER.size
+    for pt_bytes in points:
+        if len(pt_bytes) != size:
+            raise ValueError("Points of {} bytes expected, got {} bytes.".format(size, len(pt_bytes)))
+        data[offset:offset + size] = pt_bytes
+        offset += size
+
+    if offset != len(data):
+        raise ValueError("{} points expected, got {}.".format(n_points, (offset - PACKED_HEADER.size) // size))
+
+    return data
+
+
+def unpack_points(data:Union[bytes, bytearray, memoryview]) -> Iterator[memoryview]:
+    """
+    Read the points of a packed buffer, without copying them.
+
+    :param data: packed buffer
+    :return: an iterator over memoryview slices of the buffer, one per point
+    """
+
+    _, size, _ = packed_shape(data)
+    view = memoryview(data)
+
+    for offset in range(PACKED_HEADER.size, len(view), size):
+        yield view[offset:offset + size]
+
+
+def iter_points(points:Points) -> Iterator[bytes]:
+    """
+    Iterate over the exported points of a list or of a packed buffer.
+
+    :param points: query or reply
+    :return: an iterator over the exported points
+    """
+
+    if not is_packed(points):
+        return iter(points)
+    # petlib decodes points from bytes only.
+    return (bytes(pt) for pt in unpack_points(points))
+
+
+def mult_exported(group:EcGroup, secret:Bn, points:Iterable[bytes], form:int=POINT_CONVERSION_COMPRESSED, cache:Optional[ReplyCache]=None) -> Iterator[bytes]:
+    """
+    Multiply exported points by a secret, one at a time.
+
+    :param group: elliptic curve group of the points
+    :param secret: secret by which the points are multiplied
+    :param points: exported points, in any form
+    :param form: form in which the products are exported
+    :param cache: cache of the products
+    :return: an iterator over the exported products of the points with the secret
+    """
+
+    scope = ReplyCache.scope(secret, form) if cache is not None else None
+
+    for pt_bytes in points:
+        if cache is not None:
+            pt_mult_bytes = cache.get(scope, pt_bytes)
+            if pt_mult_bytes is not None:
+                yield pt_mult_bytes
+                continue
+
+        pt = EcPt.from_binary(pt_bytes, group)
+        pt_mult = secret * pt
+        pt_mult_bytes = pt_mult.export(form)
+
+        if cache is not None:
+            cache.put(scope, pt_bytes, pt_mult_bytes)
+        yield pt_mult_bytes
+
+
+def mult_points(curve:int, secret_bytes:bytes, points:List[bytes], form:int=POINT_CONVERSION_COMPRESSED) -> List[bytes]:
+    """
+    Multiply exported points by a secret.
+
+    The curve and the secret are passed in binary form as this function may run in
+    another process, and petlib objects cannot be pickled. The worker functions of the
+    protocols take their arguments in the same way.
+
+    :param curve: NID of the elliptic curve of the points
+    :param secret_bytes: secret in binary form
+    :param points: exported points, in any form
+    :param form: form in which the products are exported
+    :return: exported products of the points with the secret
+    """
+
+    return list(mult_exported(EcGroup(curve), Bn.from_binary(secret_bytes), points, form))
+
+
+def mult_query(group:EcGroup, secret:Bn, query:Points, form:Optional[int]=None, cache:Optional[ReplyCache]=None) -> Points:
+    """
+    Multiply the points of a query by a secret.
+
+    :param group: elliptic curve group of the points
+    :param secret: secret by which the points are multiplied
+    :param query: list of exported points or packed buffer
+    :param form: form in which the products are exported, the form of the query if None
+    :param cache: cache of the products
+    :return: exported products, packed if the query is
+    """
+
+    if form is None:
+        form = points_form(query)
+
+    products = mult_exported(group, secret, iter_points(query), check_form(form), cache)
+
+    if not is_packed(query):
+        return list(products)
+
+    _, _, n_points = packed_shape(query)
+    return pack_points(products, n_points, point_size(group, form), form)
+
+
+def mult_query_secrets(group:EcGroup, secrets:Dict[Hashable, Bn], query:Points, form:Optional[int]=None, cache:Optional[ReplyCache]=None) -> Dict[Hashable, Points]:
+    """
+    Multiply the points of a query by each of many secrets.
+
+    The points are decoded at most once, whatever the number of secrets.
+
+    :param group: elliptic curve group of the points
+    :param secrets: secrets by which the points are multiplied, by key
+    :param query: list of exported points or packed buffer
+    :param form: form in which the products are exported, the form of the query if None
+    :param cache: cache of the products
+    :return: exported products for each secret, by key, packed if the query is
+    """
+
+    if form is None:
+        form = points_form(query)
+    check_form(form)
+
+    points = list(iter_points(query))
+    pts = dict()
+
+    def product(secret:Bn, scope, pt_bytes:bytes) -> bytes:
+        if cache is not None:
+            pt_mult_bytes = cache.get(scope, pt_bytes)
+            if pt_mult_bytes is not None:
+                return pt_mult_bytes
+        if pt_bytes not in pts:
+            pts[pt_bytes] = EcPt.from_binary(pt_bytes, group)
+        pt_mult_bytes = (secret * pts[pt_bytes]).export(form)
+        if cache is not None:
+            cache.put(scope, pt_bytes, pt_mult_bytes)
+        return pt_mult_bytes
+
+    replies = dict()
+    for key, secret in secrets.items():
+        scope = ReplyCache.scope(secret, form) if cache is not None else None
+        products = (product(secret, scope, pt_bytes) for pt_bytes in points)
+        if is_packed(query):
+            replies[key] = pack_points(products, len(points), point_size(group, form), form)
+        else:
+            replies[key] = list(products)
+
+    return replies
+
+
+def mult_queries(group:EcGroup, secret:Bn, queries:List[Points], executor:Optional[Executor]=None, form:Optional[int]=None, cache:Optional[ReplyCache]=None) -> List[Points]:
+    """
+    Multiply the points of many queries by a secret.
+
+    Each distinct point of the batch is multiplied once. With an executor, chunks of
+    distinct points are multiplied concurrently on it.
+
+    :param group: elliptic curve group of the points
+    :param secret: secret by which the points are multiplied
+    :param queries: list of queries, each a list of exported points or a packed buffer
+    :param executor: thread or process pool on which to run the multiplications
+    :param form: form in which the products are exported, the form of each query if None
+    :param cache: cache of the products, looked up and filled before and after running on the executor
+    :return: list of exported products for each query, in the order of the queries, packed for packed queries
+    """
+
+    queries_points = [list(iter_points(query)) for query in queries]
+    queries_forms = [check_form(form) if form is not None else points_form(query) for query in queries]
+
+    # Products are computed once per distinct point and form.
+    mults = dict()
+    for reply_form in set(queries_forms):
+        distinct = list(dict.fromkeys(chain.from_iterable(
+            query_points for query_points, query_form in zip(queries_points, queries_forms) if query_form == reply_form
+        )))
+
+        if cache is not None:
+            scope = ReplyCache.scope(secret, reply_form)
+            cached, distinct_missing = cache.get_many(scope, distinct)
+            mults.update(((pt_bytes, reply_form), product) for pt_bytes, product in zip(distinct, cached) if product is not None)
+            distinct = distinct_missing
+
+        worker = partial(mult_points, group.nid(), secret.binary(), form=reply_form)
+
+        if executor is None:
+            products = worker(distinct)
+        else:
+            chunks = [distinct[i:i + MULT_CHUNK_SIZE] for i in range(0, len(distinct), MULT_CHUNK_SIZE)]
+            products = list(chain.from_iterable(executor.map(worker, chunks)))
+
+        mults.update(((pt_bytes, reply_form), product) for pt_bytes, product in zip(distinct, products))
+
+        if cache is not None:
+            cache.put_many(scope, distinct, products)
+
+    replies = list()
+    for query, query_points, reply_form in zip(queries, queries_points, queries_forms):
+        reply = [mults[(pt_bytes, reply_form)] for pt_bytes in query_points]
+        if is_packed(query):
+            reply = pack_points(reply, len(reply), point_size(group, reply_form), reply_form)
+        replies.append(reply)
+
+    return replies
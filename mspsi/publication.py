@@ -0,0 +1,335 @@
+"""
+Binary serialization of publications
+
+A serialized publication is made of the magic bytes, the length of the header on 4
+bytes, a msgpack header describing the publication, its withdrawn documents and its
+filters, and the payload of each filter. Payloads start on 8-byte boundaries so they can
+be mapped in memory. The header is followed by some reserved bytes, so it can be
+rewritten in place when the publication is updated.
+"""
+
+import io
+import mmap
+import zlib
+from typing import BinaryIO, List, Tuple
+
+import msgpack
+import numpy as np
+
+from cuckoopy_mod import CompactCuckooFilter, HighLoadCuckooFilter, ScalableCuckooFilter, SemiSortedTable, XorFilter
+from cuckoopy_mod.compactfilter import fingerprint_dtype
+
+from .mspsi import EC_NID_DEFAULT, Publication, PublishedFilter, withdrawn_docs
+
+
+FORMAT_MAGIC = b"DSNP"
+FORMAT_VERSION = 1
+FORMAT_ALIGNMENT = 8
+HEADER_LENGTH_SIZE = 4
+HEADER_RESERVE = 32
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+ENCODING_PLAIN = "plain"
+ENCODING_SEMI_SORTED = "semi_sorted"
+FILTER_CUCKOO = "cuckoo"
+FILTER_CUCKOO_HIGH_LOAD = "cuckoo_high_load"
+FILTER_SCALABLE = "scalable"
+FILTER_XOR = "xor"
+
+CUCKOO_FILTER_TYPES = {
+    FILTER_CUCKOO: CompactCuckooFilter,
+    FILTER_CUCKOO_HIGH_LOAD: HighLoadCuckooFilter,
+}
+
+
+def _padding(length:int) -> bytes:
+    return bytes(-length % FORMAT_ALIGNMENT)
+
+
+def filter_type(published_data:PublishedFilter) -> str:
+    """
+    Get the type under which a filter is serialized.
+
+    :param published_data: filter of a publication
+    :return: the type of the filter in the header
+    """
+
+    if isinstance(published_data, ScalableCuckooFilter):
+        return FILTER_SCALABLE
+    if isinstance(published_data, XorFilter):
+        return FILTER_XOR
+    if isinstance(published_data, HighLoadCuckooFilter):
+        return FILTER_CUCKOO_HIGH_LOAD
+    return FILTER_CUCKOO
+
+
+def _dump_filter(published_data:PublishedFilter, compress:bool, semi_sorted:bool) -> Tuple[dict, bytes]:
+    if isinstance(published_data, ScalableCuckooFilter):
+        # The filters of the chain are laid out like the filters of a publication.
+        filters = [_dump_filter(f, compress, semi_sorted) for f in published_data.filters]
+        payload = b"".join(payload + _padding(len(payload)) for _, payload in filters)
+        header = {
+            "type": filter_type(published_data),
+            "growth_factor": published_data.growth_factor,
+            "filters": [filter_header for filter_header, _ in filters],
+            "length": len(payload),
+        }
+        return (header, payload)
+
+    if isinstance(published_data, XorFilter):
+        header = {
+            "type": filter_type(published_data),
+            "capacity": published_data.capacity,
+            "seed": published_data.seed,
+        }
+        table = published_data.table
+    else:
+        if not isinstance(published_data, CompactCuckooFilter):
+            published_data = CompactCuckooFilter.from_filter(published_data)
+        table = published_data.table
+        if semi_sorted and not isinstance(table, SemiSortedTable):
+            table = SemiSortedTable.encode(table, published_data.fingerprint_size)
+        header = {
+            "type": filter_type(published_data),
+            "capacity": published_data.capacity,
+            "bucket_size": published_data.bucket_size,
+            "encoding": ENCODING_SEMI_SORTED if isinstance(table, SemiSortedTable) else ENCODING_PLAIN,
+        }
+
+    if isinstance(table, SemiSortedTable):
+        payload = table.data.tobytes()
+    else:
+        payload = table.astype(table.dtype.newbyteorder("<"), copy=False).tobytes()
+
+    # Empty slots are zeros, compression mostly shrinks the runs of empty slots.
+    compression = COMPRESSION_ZLIB if compress else COMPRESSION_NONE
+    if compress:
+        payload = zlib.compress(payload)
+
+    header.update({
+        "fingerprint_size": published_data.fingerprint_size,
+        "size": published_data.size,
+        "compression": compression,
+        "length": len(payload),
+    })
+
+    return (header, payload)
+
+
+def _load_filter(header:dict, payload, mapped:bool=False) -> PublishedFilter:
+    if header["type"] == FILTER_SCALABLE:
+        payload = memoryview(payload)
+        filters = [
+            _load_filter(filter_header, payload[offset:offset + filter_header["length"]], mapped)
+            for filter_header, offset in zip(header["filters"], payload_offsets(header, 0))
+        ]
+        return ScalableCuckooFilter.from_filters(filters, header["growth_factor"])
+
+    if header["type"] != FILTER_XOR and header["type"] not in CUCKOO_FILTER_TYPES:
+        raise ValueError("Unsupported filter type: {}".format(header["type"]))
+
+    if mapped and header["compression"] != COMPRESSION_NONE:
+        raise ValueError("Compressed publications cannot be mapped in memory.")
+
+    if header["compression"] == COMPRESSION_ZLIB:
+        payload = bytearray(zlib.decompress(payload))
+    elif header["compression"] != COMPRESSION_NONE:
+        raise ValueError("Unsupported compression: {}".format(header["compression"]))
+
+    if header.get("encoding", ENCODING_PLAIN) == ENCODING_SEMI_SORTED:
+        data = np.frombuffer(payload, dtype=np.uint8)
+        table = SemiSortedTable(data, header["capacity"], header["bucket_size"], header["fingerprint_size"])
+        return CUCKOO_FILTER_TYPES[header["type"]].from_table(table, header["fingerprint_size"], size=header["size"])
+
+    dtype = fingerprint_dtype(header["fingerprint_size"])
+    table = np.frombuffer(payload, dtype=dtype.newbyteorder("<"))
+    table = table.astype(dtype, copy=False)
+
+    if header["type"] == FILTER_XOR:
+        return XorFilter(table, header["seed"], header["fingerprint_size"], header["size"])
+
+    table = table.reshape(header["capacity"], header["bucket_size"])
+    return CUCKOO_FILTER_TYPES[header["type"]].from_table(table, header["fingerprint_size"], size=header["size"])
+
+
+def pack_header(header:dict, length:int) -> bytes:
+    """
+    Pack the header of a publication, padded to a given length so it can be written in place.
+
+    :param header: header of the publication
+    :param length: length of the packed header
+    :return: the packed header
+    """
+
+    packed = msgpack.packb(header)
+    if len(packed) > length:
+        raise ValueError("The header of the publication does not fit in place.")
+    return packed + bytes(length - len(packed))
+
+
+def dump(published:Tuple[int, PublishedFilter], fd:BinaryIO, curve:int=EC_NID_DEFAULT, compress:bool=False, semi_sorted:bool=False, revision:int=0):
+    """
+    Serialize a publication to a file object.
+
+    :param published: publication as returned by MSPSIServer.publish
+    :param fd: binary file object to write to
+    :param curve: NID of the elliptic curve with which the publication was made
+    :param compress: whether to compress the filters with zlib
+    :param semi_sorted: whether to encode the buckets of cuckoo filters as semi-sorted buckets
+    :param revision: revision of the publication, increased by each update
+    """
+
+    filters = [_dump_filter(published_data, compress, semi_sorted) for published_data in published[1:]]
+
+    header = {
+        "version": FORMAT_VERSION,
+        "curve": curve,
+        "revision": revision,
+        "n_docs": published[0],
+        "withdrawn": sorted(withdrawn_docs(published)),
+        "filters": [filter_header for filter_header, _ in filters],
+    }
+    header = pack_header(header, len(msgpack.packb(header)) + HEADER_RESERVE)
+
+    head = FORMAT_MAGIC + len(header).to_bytes(HEADER_LENGTH_SIZE, byteorder="big") + header
+    fd.write(head)
+    fd.write(_padding(len(head)))
+
+    for _, payload in filters:
+        fd.write(payload)
+        fd.write(_padding(len(payload)))
+
+
+def load_header(fd:BinaryIO, curve:int) -> Tuple[dict, int]:
+    """
+    Read the header of a serialized publication, leaving the file object at the first payload.
+
+    :param fd: binary file object to read from
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the header and the offset of the first payload
+    """
+
+    head = fd.read(len(FORMAT_MAGIC) + HEADER_LENGTH_SIZE)
+    if head[:len(FORMAT_MAGIC)] != FORMAT_MAGIC:
+        raise ValueError("Not a serialized publication.")
+
+    header_length = int.from_bytes(head[len(FORMAT_MAGIC):], byteorder="big")
+    # The header may be followed by reserved bytes.
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(fd.read(header_length))
+    header = unpacker.unpack()
+
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported publication format version: {}".format(header["version"]))
+    if header["curve"] != curve:
+        raise ValueError("Publication made on curve {} instead of {}.".format(header["curve"], curve))
+
+    # Skip to the first payload.
+    offset = len(head) + header_length
+    padding = _padding(offset)
+    fd.read(len(padding))
+
+    return (header, offset + len(padding))
+
+
+def _published(header:dict, filters:List[PublishedFilter]) -> Publication:
+    # Headers written before documents could be withdrawn have no withdrawn doc ids.
+    return Publication(header["n_docs"], filters, header.get("withdrawn", ()))
+
+
+def payload_offsets(header:dict, offset:int) -> List[int]:
+    """
+    Compute the offsets of the payloads of the filters of a publication or of a chain.
+
+    :param header: header of the publication or of the chain
+    :param offset: offset of the first payload
+    :return: the offset of the payload of each filter
+    """
+
+    offsets = list()
+    for filter_header in header["filters"]:
+        offsets.append(offset)
+        offset += filter_header["length"]
+        offset += len(_padding(filter_header["length"]))
+    return offsets
+
+
+def load(fd:BinaryIO, curve:int=EC_NID_DEFAULT) -> Publication:
+    """
+    Deserialize a publication from a file object.
+
+    :param fd: binary file object to read from
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the publication
+    """
+
+    header, _ = load_header(fd, curve)
+    filters = list()
+
+    for filter_header in header["filters"]:
+        payload = bytearray(filter_header["length"])
+        if fd.readinto(payload) != len(payload):
+            raise ValueError("Truncated publication.")
+        fd.read(len(_padding(filter_header["length"])))
+        filters.append(_load_filter(filter_header, payload))
+
+    return _published(header, filters)
+
+
+def dumps(published:Tuple[int, PublishedFilter], curve:int=EC_NID_DEFAULT, compress:bool=False, semi_sorted:bool=False, revision:int=0) -> bytes:
+    """
+    Serialize a publication.
+
+    :param published: publication as returned by MSPSIServer.publish
+    :param curve: NID of the elliptic curve with which the publication was made
+    :param compress: whether to compress the filters with zlib
+    :param semi_sorted: whether to encode the buckets of cuckoo filters as semi-sorted buckets
+    :param revision: revision of the publication, increased by each update
+    :return: the serialized publication
+    """
+
+    fd = io.BytesIO()
+    dump(published, fd, curve, compress, semi_sorted, revision)
+    return fd.getvalue()
+
+
+def loads(data:bytes, curve:int=EC_NID_DEFAULT) -> Publication:
+    """
+    Deserialize a publication.
+
+    :param data: serialized publication
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the publication
+    """
+
+    return load(io.BytesIO(data), curve)
+
+
+def load_mapped(path:str, curve:int=EC_NID_DEFAULT) -> Publication:
+    """
+    Open a serialized publication as read-only filters mapped in memory.
+
+    The tables of the filters are read directly from the mapped pages of the file,
+    so opening does not depend on the size of the publication, and the pages are
+    shared through the page cache by every process mapping the same file. The
+    publication must have been serialized without compression.
+
+    :param path: path of the serialized publication
+    :param curve: NID of the elliptic curve expected for the publication
+    :return: the publication
+    """
+
+    with open(path, "rb") as fd:
+        header, offset = load_header(fd, curve)
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    filters = list()
+
+    for filter_header, offset in zip(header["filters"], payload_offsets(header, offset)):
+        if offset + filter_header["length"] > len(mapped):
+            raise ValueError("Truncated publication.")
+        payload = memoryview(mapped)[offset:offset + filter_header["length"]]
+        filters.append(_load_filter(filter_header, payload, mapped=True))
+
+    return _published(header, filters)
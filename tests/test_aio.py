@@ -0,0 +1,100 @@
+import asyncio
+import os
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from mspsi.aio import AsyncMSPSIClient, AsyncMSPSIServer
+from mspsi.cache import PointCache, ReplyCache
+from mspsi.mspsi import MSPSIClient, MSPSIServer
+from mspsi.points import iter_points
+
+
+class TestAsyncMSPSI(unittest.TestCase):
+    def __init__(self, tests):
+        curve = 415
+        self.mspsi_client = MSPSIClient(curve)
+        self.mspsi_server = MSPSIServer(curve)
+        super().__init__(tests)
+
+    def test_functionality(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] * 10
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        async def run(executor):
+            client = AsyncMSPSIClient(self.mspsi_client, executor, chunk_size=2, batch_size=7, processes=2)
+            server = AsyncMSPSIServer(self.mspsi_server, executor, chunk_size=2)
+
+            (secret_client, query) = await client.query(['foo', '', 'ghjk'], packed=True)
+            reply = await server.reply(secret_server, query)
+            self.assertEqual(reply, self.mspsi_server.reply(secret_server, query))
+
+            chunks = [chunk async for chunk in server.reply_stream(secret_server, list(iter_points(query)))]
+            self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+            self.assertEqual(sum(chunks, []), list(iter_points(reply)))
+
+            batches = [batch async for batch in client.compute_cardinalities_stream(secret_client, reply, published)]
+            self.assertEqual([doc_id_start for doc_id_start, _ in batches], [0, 7, 14, 21, 28])
+
+            return await client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(asyncio.run(run(None)), [2, 1, 0] * 10)
+        for executor_cls in (ThreadPoolExecutor, ProcessPoolExecutor):
+            with executor_cls(2) as executor:
+                self.assertEqual(asyncio.run(run(executor)), [2, 1, 0] * 10)
+
+    def test_pool(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] * 10
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+        client = AsyncMSPSIClient(self.mspsi_client, batch_size=7, processes=2)
+        client.open_pool(published)
+
+        async def search(kwds):
+            (secret_client, query) = await client.query(kwds)
+            reply = self.mspsi_server.reply(secret_server, query)
+            return await client.compute_cardinalities(secret_client, reply, published)
+
+        async def run():
+            return await asyncio.gather(search(['foo', '']), search(['asdf']))
+
+        # Concurrent streams of the publication share its pool.
+        try:
+            self.assertEqual(asyncio.run(run()), [[2, 1, 0] * 10, [0, 0, 1] * 10])
+            self.assertEqual(list(client.pools), [id(published[1])])
+            # Work submitted to the pool runs in at most its two worker processes.
+            pool = client.pools[id(published[1])][1]
+            pids = {pool.submit(os.getpid).result() for _ in range(8)}
+            self.assertLessEqual(len(pids), 2)
+            self.assertNotIn(os.getpid(), pids)
+            with self.assertRaises(ValueError):
+                client.open_pool(published)
+        finally:
+            client.close_pool(published)
+
+        self.assertEqual(client.pools, {})
+        with self.assertRaises(ValueError):
+            client.close_pool(published)
+
+    def test_concurrent(self):
+        point_cache = PointCache()
+        reply_cache = ReplyCache()
+        client = AsyncMSPSIClient(MSPSIClient(cache=point_cache), chunk_size=1)
+        server = AsyncMSPSIServer(MSPSIServer(reply_cache=reply_cache), chunk_size=1)
+        (secret_server, published) = server.server.publish([['foo', 'bar'], ['foo'], []])
+
+        async def search(kwds):
+            (secret_client, query) = await client.query(kwds)
+            reply = await server.reply(secret_server, query)
+            # A retried query is answered from the cache.
+            self.assertEqual(await server.reply(secret_server, query), reply)
+            return await client.compute_cardinalities(secret_client, reply, published)
+
+        async def run():
+            return await asyncio.gather(search(['foo', 'bar']), search(['bar']), search([]))
+
+        self.assertEqual(asyncio.run(run()), [[2, 1, 0], [1, 0, 0], [0, 0, 0]])
+        self.assertEqual((reply_cache.hits, reply_cache.misses), (3, 3))
+        self.assertEqual(len(point_cache), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+
+from petlib.ec import EcGroup
+
+from mspsi.cache import PointCache, ReplyCache
+from mspsi.cpsi import CPSIClient, CPSIServer
+from mspsi.mspsi import MSPSIClient, MSPSIServer
+
+
+class TestPointCache(unittest.TestCase):
+    def __init__(self, tests):
+        self.group = EcGroup(415)
+        super().__init__(tests)
+
+    def test_lru(self):
+        cache = PointCache(maxsize=2)
+
+        pt_foo = cache.hash_to_point(self.group, b'foo')
+        self.assertEqual(pt_foo, self.group.hash_to_point(b'foo'))
+        cache.hash_to_point(self.group, b'bar')
+        self.assertIs(cache.hash_to_point(self.group, b'foo'), pt_foo)
+        cache.hash_to_point(self.group, b'baz')
+
+        # 'bar' was the least recently used point.
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.hash_to_point(self.group, b'bar')
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        # Points are cached per curve.
+        cache.hash_to_point(EcGroup(714), b'bar')
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            vocabulary = os.path.join(tmp, 'vocabulary.txt')
+            with open(vocabulary, 'w') as fd:
+                fd.write('foo\nbar\n\n')
+
+            cache = PointCache(path=os.path.join(tmp, 'points'))
+            self.assertEqual(cache.prewarm(self.group, vocabulary), 3)
+            cache.close()
+
+            cache = PointCache(path=os.path.join(tmp, 'points'))
+            for kwd in (b'foo', b'bar', b''):
+                self.assertEqual(cache.hash_to_point(self.group, kwd), self.group.hash_to_point(kwd))
+            cache.close()
+
+            self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 3, 0))
+
+            # A read-only store does not record the keywords missing from it.
+            cache = PointCache(path=os.path.join(tmp, 'points'), readonly=True)
+            self.assertEqual(cache.hash_to_point(self.group, b'baz'), self.group.hash_to_point(b'baz'))
+            cache.close()
+
+            cache = PointCache(maxsize=0, path=os.path.join(tmp, 'points'), readonly=True)
+            cache.hash_to_point(self.group, b'baz')
+            cache.hash_to_point(self.group, b'foo')
+            cache.close()
+
+            self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 1, 1))
+
+    def test_mspsi(self):
+        cache = PointCache()
+        mspsi_client = MSPSIClient(cache=cache)
+        mspsi_server = MSPSIServer(cache=cache)
+
+        (secret_server, published) = mspsi_server.publish([['foo', 'bar'], ['foo']])
+        (secret_client, query) = mspsi_client.query(['foo', 'baz'])
+        reply = mspsi_server.reply(secret_server, query)
+
+        self.assertEqual(mspsi_client.compute_cardinalities(secret_client, reply, published), [1, 1])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+
+class TestReplyCache(unittest.TestCase):
+    def test_mspsi(self):
+        cache = ReplyCache(maxsize=4)
+        mspsi_client = MSPSIClient()
+        mspsi_server = MSPSIServer(reply_cache=cache)
+        uncached_server = MSPSIServer()
+
+        (secret_server, published) = mspsi_server.publish([['foo', 'bar'], ['foo']])
+        (secret_client, query) = mspsi_client.query(['foo', 'baz'])
+        reply = mspsi_server.reply(secret_server, query)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        # The same points are answered from the cache, packed or not.
+        self.assertEqual(mspsi_server.reply(secret_server, query), reply)
+        self.assertEqual(mspsi_server.reply_many(secret_server, [query, query]), [reply, reply])
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+        self.assertEqual(cache.hit_rate, 4 / 6)
+        self.assertEqual(mspsi_client.compute_cardinalities(secret_client, reply, published), [1, 1])
+
+        # Replies are scoped per secret.
+        (other_secret, _) = mspsi_server.publish([['foo']])
+        self.assertEqual(mspsi_server.reply(other_secret, query), uncached_server.reply(other_secret, query))
+        self.assertEqual((len(cache), cache.misses), (4, 4))
+        self.assertFalse(any(secret_server.binary() in scope for scope, _ in cache.replies))
+
+        mspsi_server.register('a', secret_server)
+        mspsi_server.register('b', other_secret)
+        self.assertEqual(mspsi_server.reply_all(query), {'a': reply, 'b': uncached_server.reply(other_secret, query)})
+
+        self.assertEqual(cache.misses, 4)
+
+        mspsi_server.unregister('b')
+        self.assertEqual(len(cache), 2)
+
+        # The least recently used replies are evicted.
+        (third_secret, _) = mspsi_server.publish([['foo']])
+        mspsi_server.reply_many(third_secret, [query, query])
+        self.assertEqual((len(cache), cache.misses), (4, 6))
+        mspsi_server.reply(other_secret, query)
+        mspsi_server.reply(secret_server, query)
+        self.assertEqual((len(cache), cache.misses), (4, 10))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_cpsi(self):
+        cache = ReplyCache()
+        cpsi_client = CPSIClient()
+        cpsi_server = CPSIServer(reply_cache=cache)
+
+        (secret_server, published) = cpsi_server.publish(['foo', 'bar'])
+        (secret_client, query) = cpsi_client.query(['foo', 'baz'], packed=True)
+        for _ in range(3):
+            reply = cpsi_server.reply(secret_server, query)
+            self.assertEqual(cpsi_client.compute_cardinality(secret_client, reply, published), 1)
+
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
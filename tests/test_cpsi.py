@@ -1,7 +1,10 @@
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from mspsi.cpsi import CPSIClient, CPSIServer
+from mspsi.points import iter_points, points_form
 from petlib.bn import Bn
+from petlib.ec import POINT_CONVERSION_UNCOMPRESSED
 
 
 class TestCPSI(unittest.TestCase):
@@ -36,6 +39,39 @@ class TestCPSI(unittest.TestCase):
 
         self.assertEqual(card, 0)
 
+    def test_reply_many(self):
+        server_secret, _ = self.cpsi_server.publish(['foo'])
+        queries = [self.cpsi_client.query(kwds)[1] for kwds in (['foo', 'bar'], ['bar'], ['foo', 'bar'])]
+        expected = [self.cpsi_server.reply(server_secret, query) for query in queries]
+
+        with ThreadPoolExecutor(2) as executor:
+            replies = self.cpsi_server.reply_many(server_secret, queries, executor)
+
+        self.assertEqual(replies, expected)
+
+    def test_packed(self):
+        server_secret, published = self.cpsi_server.publish(['foo', 'bar', ''])
+
+        client_secret, query = self.cpsi_client.query(['foo', '', 'baz'], packed=True)
+        reply = self.cpsi_server.reply(server_secret, query)
+        card = self.cpsi_client.compute_cardinality(client_secret, memoryview(reply), published)
+
+        self.assertEqual(card, 2)
+        self.assertEqual(list(iter_points(reply)), self.cpsi_server.reply(server_secret, list(iter_points(query))))
+
+        with self.assertRaises(ValueError):
+            self.cpsi_server.reply(server_secret, query + b"\0")
+
+    def test_point_form(self):
+        server_secret, published = self.cpsi_server.publish(['foo', 'bar', ''])
+        client = CPSIClient(415, point_form=POINT_CONVERSION_UNCOMPRESSED)
+
+        client_secret, query = client.query(['foo', '', 'baz'], packed=True)
+        reply = self.cpsi_server.reply(server_secret, query)
+
+        self.assertEqual(points_form(reply), POINT_CONVERSION_UNCOMPRESSED)
+        self.assertEqual(client.compute_cardinality(client_secret, reply, published), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,275 @@
+import os
+import unittest
+
+import numpy as np
+
+from cuckoopy_mod import CompactCuckooFilter, CuckooFilter, HighLoadCuckooFilter, ScalableCuckooFilter, SemiSortedTable, XorFilter, hashutils, semi_sorted_filter
+from cuckoopy_mod.cuckoofilter import CuckooFilterFullException
+
+
+class TestCompactCuckooFilter(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(2000)]
+
+    def test_insert_contains_delete(self):
+        cf = CompactCuckooFilter(capacity=1000, bucket_size=6, fingerprint_size=4)
+
+        for item in self.items:
+            self.assertTrue(cf.insert(item))
+
+        self.assertEqual(len(cf), len(self.items))
+        self.assertEqual(cf.table.shape, (1000, 6))
+        for item in self.items:
+            self.assertIn(item, cf)
+
+        for item in self.items[:1000]:
+            self.assertTrue(cf.delete(item))
+
+        self.assertEqual(len(cf), 1000)
+        for item in self.items[1000:]:
+            self.assertTrue(cf.contains(item))
+
+    def test_empty_fingerprint(self):
+        cf = CompactCuckooFilter(capacity=10, bucket_size=4, fingerprint_size=4)
+        item = bytes(4) + os.urandom(60)
+
+        self.assertFalse(cf.contains(item))
+        cf.insert(item)
+        self.assertTrue(cf.contains(item))
+        self.assertTrue(cf.delete(item))
+        self.assertFalse(cf.contains(item))
+
+    def test_full(self):
+        cf = CompactCuckooFilter(capacity=10, bucket_size=2, fingerprint_size=4)
+
+        with self.assertRaises(CuckooFilterFullException):
+            for item in self.items:
+                cf.insert(item)
+
+    def test_same_api(self):
+        cf = CuckooFilter(capacity=1000, bucket_size=6, fingerprint_size=4)
+        ccf = CompactCuckooFilter(capacity=1000, bucket_size=6, fingerprint_size=4)
+
+        for item in self.items[:1000]:
+            cf.insert(item)
+            ccf.insert(item)
+
+        for item in self.items:
+            self.assertEqual(cf.contains(item), ccf.contains(item))
+
+
+class TestHighLoadCuckooFilter(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(10000)]
+
+    def test_involutive(self):
+        cf = HighLoadCuckooFilter(capacity=1001, bucket_size=6, fingerprint_size=4)
+        fingerprints, i, j = cf._probe_many(hashutils.as_array(self.items))
+
+        self.assertTrue((cf._get_alternate_indices(j, fingerprints) == i).all())
+        for f, a, b in zip(fingerprints.tolist()[:100], i.tolist(), j.tolist()):
+            self.assertEqual(cf._get_alternate_index(a, f), b)
+            self.assertEqual(cf._get_alternate_index(b, f), a)
+
+    def test_iterables(self):
+        # Iterators are read once, though the items are looked up once inserted.
+        for digests in ((item for item in self.items[:1000]), set(self.items[:1000])):
+            cf = HighLoadCuckooFilter.from_digests(digests, capacity=200, bucket_size=6, fingerprint_size=4)
+            self.assertEqual(len(cf), 1000)
+            self.assertTrue(cf.contains_many(self.items[:1000]).all())
+
+        self.assertEqual(len(CompactCuckooFilter.from_digests(iter([]), capacity=10)), 0)
+        with self.assertRaises(TypeError):
+            CompactCuckooFilter.from_digests(1000, capacity=10)
+
+    def test_high_load(self):
+        capacity = HighLoadCuckooFilter.capacity_for(len(self.items), bucket_size=6)
+        cf = HighLoadCuckooFilter(capacity=capacity, bucket_size=6, fingerprint_size=4)
+
+        for item in self.items:
+            cf.insert(item)
+
+        self.assertGreater(len(cf) / (capacity * 6), 0.89)
+        self.assertTrue(cf.contains_many(self.items).all())
+        self.assertTrue(all(item in cf for item in self.items))
+
+
+class TestScalableCuckooFilter(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(5000)]
+
+    def test_insert(self):
+        cf = ScalableCuckooFilter(capacity=10, bucket_size=4, fingerprint_size=4)
+        for item in self.items[:1000]:
+            self.assertTrue(cf.insert(item))
+
+        self.assertEqual(len(cf), 1000)
+        self.assertGreater(cf.resizes, 0)
+        self.assertEqual(cf.filters[1].capacity, 20)
+        for item in self.items[:1000]:
+            self.assertIn(item, cf)
+        self.assertTrue(cf.delete(self.items[0]))
+        self.assertEqual(len(cf), 999)
+
+    def test_insert_many(self):
+        cf = ScalableCuckooFilter(capacity=10, bucket_size=6, fingerprint_size=4)
+        self.assertTrue(cf.insert_many(self.items).all())
+
+        self.assertEqual(len(cf), len(self.items))
+        self.assertEqual(cf.resizes, 1)
+        self.assertGreater(cf.load_factor, 0.5)
+        self.assertLessEqual(cf.load_factor, HighLoadCuckooFilter.MAX_LOAD_FACTOR)
+        self.assertTrue(cf.contains_many(self.items).all())
+
+    def test_not_involutive(self):
+        # Evictions in these filters may lose items, see CompactCuckooFilter.insert_many.
+        for filter_cls in (CuckooFilter, CompactCuckooFilter):
+            cf = ScalableCuckooFilter(capacity=10, bucket_size=2, fingerprint_size=4, filter_cls=filter_cls)
+            for start in range(0, len(self.items), 250):
+                self.assertTrue(cf.insert_many(self.items[start:start + 250]).all())
+
+            self.assertEqual(len(cf), len(self.items))
+            self.assertGreater(cf.resizes, 1)
+            self.assertTrue(cf.contains_many(self.items).all())
+
+
+class TestSemiSortedTable(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(4000)]
+
+    def test_encode(self):
+        for bucket_size, fingerprint_size in ((4, 1), (4, 2), (6, 4), (8, 3), (6, 7)):
+            cf = HighLoadCuckooFilter(capacity=HighLoadCuckooFilter.capacity_for(1000, bucket_size), bucket_size=bucket_size, fingerprint_size=fingerprint_size)
+            for item in self.items[:1000]:
+                cf.insert(item)
+
+            table = SemiSortedTable.encode(cf.table, fingerprint_size, chunk_size=100)
+            self.assertTrue((table.decode() == np.sort(cf.table, axis=1)).all())
+            self.assertTrue((table[[2, 0]] == np.sort(cf.table[[2, 0]], axis=1)).all())
+            self.assertLess(table.nbytes, cf.table.nbytes)
+
+    def test_filter(self):
+        cf = HighLoadCuckooFilter(capacity=HighLoadCuckooFilter.capacity_for(2000, 6), bucket_size=6, fingerprint_size=4)
+        for item in self.items[:2000]:
+            cf.insert(item)
+
+        ssf = semi_sorted_filter(cf)
+
+        self.assertIsInstance(ssf, HighLoadCuckooFilter)
+        self.assertEqual(len(ssf), 2000)
+        self.assertEqual(ssf.contains_many(self.items).tolist(), cf.contains_many(self.items).tolist())
+        for item in self.items[1990:2010]:
+            self.assertEqual(item in ssf, item in cf)
+        with self.assertRaises(ValueError):
+            ssf.insert(self.items[-1])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            SemiSortedTable.encode(np.zeros((10, 4), dtype=np.uint64), 8)
+
+
+class TestContainsMany(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(2000)]
+
+    def check_contains_many(self, cf):
+        for item in self.items[:1000]:
+            cf.insert(item)
+
+        expected = [cf.contains(item) for item in self.items]
+
+        self.assertEqual(cf.contains_many(self.items).tolist(), expected)
+        self.assertEqual(cf.contains_many(b''.join(self.items), item_size=64).tolist(), expected)
+        self.assertTrue(all(expected[:1000]))
+
+    def test_list_filter(self):
+        self.check_contains_many(CuckooFilter(capacity=500, bucket_size=6, fingerprint_size=4))
+
+    def test_compact_filter(self):
+        self.check_contains_many(CompactCuckooFilter(capacity=500, bucket_size=6, fingerprint_size=4))
+
+    def test_fingerprint_sizes(self):
+        for fingerprint_size in (1, 2, 3, 8):
+            self.check_contains_many(CompactCuckooFilter(capacity=500, bucket_size=6, fingerprint_size=fingerprint_size))
+
+    def test_empty(self):
+        cf = CompactCuckooFilter(capacity=10, bucket_size=4, fingerprint_size=4)
+
+        self.assertEqual(len(cf.contains_many([])), 0)
+        with self.assertRaises(ValueError):
+            cf.contains_many(b'')
+
+
+class TestFromDigests(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(10000)]
+
+    def test_from_digests(self):
+        for cls in (CuckooFilter, CompactCuckooFilter):
+            cf = cls.from_digests(self.items[:1000], capacity=500, bucket_size=6, fingerprint_size=4)
+            self.assertEqual(len(cf), 1000)
+            self.assertTrue(cf.contains_many(self.items[:1000]).all())
+
+    def test_high_load(self):
+        capacity = HighLoadCuckooFilter.capacity_for(len(self.items), bucket_size=6)
+        cf = HighLoadCuckooFilter.from_digests(b''.join(self.items), capacity, bucket_size=6, fingerprint_size=4, item_size=64)
+
+        self.assertEqual(len(cf), len(self.items))
+        self.assertEqual(np.count_nonzero(cf.table), len(self.items))
+        self.assertTrue(cf.contains_many(self.items).all())
+
+    def test_insert_many(self):
+        # Evictions in CompactCuckooFilter may lose items, see insert_many.
+        cf = HighLoadCuckooFilter(capacity=500, bucket_size=6, fingerprint_size=4)
+        for item in self.items[:1000]:
+            cf.insert(item)
+        for item in self.items[:500]:
+            cf.delete(item)
+
+        self.assertTrue(cf.insert_many(self.items[1000:2000]).all())
+        self.assertEqual(len(cf), 1500)
+        self.assertTrue(cf.contains_many(self.items[500:2000]).all())
+
+    def test_full(self):
+        # Too many items are reported before anything is inserted.
+        cf = CompactCuckooFilter(capacity=10, bucket_size=4, fingerprint_size=4)
+        with self.assertRaises(CuckooFilterFullException):
+            cf.insert_many(self.items[:41])
+        self.assertEqual(len(cf), 0)
+
+        # Items failing the evictions are reported once all were tried.
+        cf = HighLoadCuckooFilter(capacity=100, bucket_size=2, fingerprint_size=4, max_displacements=10)
+        inserted = cf.insert_many(self.items[:200])
+        self.assertFalse(inserted.all())
+        self.assertEqual(len(cf), np.count_nonzero(inserted))
+        self.assertEqual(np.count_nonzero(cf.table), len(cf))
+        self.assertTrue(cf.contains_many([item for item, found in zip(self.items, inserted) if found]).all())
+
+        with self.assertRaises(CuckooFilterFullException):
+            HighLoadCuckooFilter.from_digests(self.items[:200], capacity=100, bucket_size=2, fingerprint_size=4, max_displacements=10)
+
+
+class TestXorFilter(unittest.TestCase):
+    def setUp(self):
+        self.items = [os.urandom(64) for _ in range(2000)]
+
+    def test_contains(self):
+        xf = XorFilter.from_digests(self.items[:1000] + self.items[:10], fingerprint_size=4)
+
+        self.assertEqual(len(xf), 1000)
+        self.assertEqual(xf.capacity % 3, 0)
+        self.assertLess(xf.capacity, 1.3 * 1000)
+        self.assertTrue(xf.contains_many(self.items[:1000]).all())
+        self.assertFalse(xf.contains_many(b''.join(self.items[1000:]), item_size=64).any())
+        for item in self.items[:10] + self.items[-10:]:
+            self.assertEqual(item in xf, item in self.items[:1000])
+
+    def test_empty(self):
+        xf = XorFilter.from_digests([], fingerprint_size=4)
+
+        self.assertEqual(len(xf), 0)
+        self.assertFalse(xf.contains_many(self.items).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
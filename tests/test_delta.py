@@ -0,0 +1,168 @@
+import os
+import tempfile
+import unittest
+
+import msgpack
+
+from cuckoopy_mod import ScalableCuckooFilter, XorFilter
+from mspsi import delta, publication
+from mspsi.mspsi import MSPSIClient, MSPSIServer
+
+
+class TestDelta(unittest.TestCase):
+    def __init__(self, tests):
+        curve = 415
+        self.mspsi_client = MSPSIClient(curve)
+        self.mspsi_server = MSPSIServer(curve)
+        super().__init__(tests)
+
+    def check_cardinalities(self, secret_server, published, expected):
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards, expected)
+
+    def test_apply(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] + [['kwd{}_{}'.format(i, j) for j in range(20)] for i in range(20)]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+        data = publication.dumps(published)
+
+        # The filters are turned into chains, and the first one grows.
+        published = self.mspsi_server.append(secret_server, published, [['foo', ''], ['kwd{}'.format(i) for i in range(100)]])
+        changes = delta.dumps(publication.loads(data), published, 0)
+
+        self.assertLess(len(changes), len(publication.dumps(published)))
+        self.assertEqual(delta.loads(changes)["revision"], 1)
+
+        updated = delta.apply(publication.loads(data), changes, 0)
+
+        self.assertEqual(updated[0], 25)
+        self.assertIsInstance(updated[1], ScalableCuckooFilter)
+        self.assertEqual(updated[1].resizes, published[1].resizes)
+        self.assertEqual(len(updated[1]), len(published[1]))
+        self.check_cardinalities(secret_server, updated, [2, 1, 0] + [0] * 20 + [2, 0])
+
+        # Nothing changed since the last revision.
+        self.assertEqual(delta.apply(updated, delta.dumps(updated, published, 1), 1)[0], 25)
+
+    def test_apply_file(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish_stream(kwds, n_kwds=100)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                publication.dump(published, fd)
+            mapped = publication.load_mapped(path)
+
+            old = publication.load_mapped(path)
+            published = self.mspsi_server.append(secret_server, published, [['foo', '']])
+            changes = delta.dumps(old, published, 0)
+
+            self.assertEqual(delta.apply_file(path, changes), 1)
+
+            self.check_cardinalities(secret_server, publication.load_mapped(path), [2, 1, 0, 2])
+
+            # Mapped copies see the changed buckets, but must be opened again for the new documents.
+            self.assertTrue((mapped[1].filters[0].table == published[1].filters[0].table).all())
+            self.assertEqual(mapped[0], 3)
+
+            with self.assertRaises(ValueError):
+                delta.apply_file(path, changes)
+
+    def test_unpublish(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                publication.dump(published, fd)
+
+            old = publication.load_mapped(path)
+            self.mspsi_server.unpublish(secret_server, published, 1, kwds[1])
+            changes = delta.dumps(old, published, 0)
+
+            # Only the buckets of the two keywords of the document changed.
+            self.assertLessEqual(len(delta.loads(changes)["filters"][0]["buckets"]), 2 * delta.DELTA_INDEX_DTYPE.itemsize)
+            delta.apply_file(path, changes)
+            self.check_cardinalities(secret_server, publication.load_mapped(path), [2, 0, 0])
+            self.assertEqual(publication.load_mapped(path).withdrawn, {1})
+
+        # Only the withdrawn doc ids change when a document without keywords is withdrawn.
+        (secret_server, published) = self.mspsi_server.publish(kwds + [[]], filter_cls=XorFilter)
+        old = publication.loads(publication.dumps(published))
+        self.mspsi_server.unpublish(secret_server, published, 3, [])
+        changes = delta.dumps(old, published, 0)
+
+        self.assertEqual(delta.loads(changes)["filters"][0]["buckets"], b'')
+        self.assertEqual(delta.apply(old, changes, 0).withdrawn, {3})
+
+    def test_rewrite_file(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        for compress in (False, True):
+            data = publication.dumps(published, compress=compress)
+            changed = self.mspsi_server.append(secret_server, publication.loads(data), [['foo', '']] * 20)
+            changes = delta.dumps(publication.loads(data), changed, 0)
+
+            # The filters became growing chains, the file is written again from the delta.
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'publication')
+                with open(path, 'wb') as fd:
+                    fd.write(data)
+
+                self.assertEqual(delta.apply_file(path, changes), 1)
+                with open(path, 'rb') as fd:
+                    updated = publication.load(fd)
+
+                self.assertEqual(updated[0], 23)
+                self.assertIsInstance(updated[1], ScalableCuckooFilter)
+                self.check_cardinalities(secret_server, updated, [2, 1, 0] + [2] * 20)
+                self.assertEqual(delta.apply_file(path, delta.dumps(updated, changed, 1)), 2)
+
+    def test_apply_mismatch(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+        old = publication.loads(publication.dumps(published))
+        self.mspsi_server.unpublish(secret_server, published, 1, kwds[1])
+
+        # The corpus-wide filter does not match the delta, the first filter is left as is.
+        changes = delta.loads(delta.dumps(old, published, 0))
+        changes["filters"][1]["capacity"] += 1
+        table = old[1].table.copy()
+
+        with self.assertRaises(ValueError):
+            delta.apply(old, delta.DELTA_MAGIC + msgpack.packb(changes), 0)
+        self.assertTrue((old[1].table == table).all())
+        self.check_cardinalities(secret_server, old, [2, 1, 0])
+
+    def test_errors(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+        data = publication.dumps(published)
+        changed = self.mspsi_server.append(secret_server, publication.loads(data), [['foo']] * 20)
+        changes = delta.dumps(publication.loads(data), changed, 0)
+
+        with self.assertRaises(ValueError):
+            delta.apply(publication.loads(data), changes, 1)
+        with self.assertRaises(ValueError):
+            delta.loads(changes, curve=714)
+
+        # Semi-sorted buckets cannot be updated, the file is left as is.
+        data = publication.dumps(published, semi_sorted=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                fd.write(data)
+
+            with self.assertRaises(ValueError):
+                delta.apply_file(path, changes)
+            with open(path, 'rb') as fd:
+                self.assertEqual(fd.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
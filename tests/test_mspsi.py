@@ -1,10 +1,14 @@
 import random
 import string
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from petlib.bn import Bn
+from petlib.ec import POINT_CONVERSION_COMPRESSED, POINT_CONVERSION_UNCOMPRESSED
 
+from cuckoopy_mod import CompactCuckooFilter, CuckooFilter, HighLoadCuckooFilter, ScalableCuckooFilter, XorFilter
 from mspsi.mspsi import MSPSIClient, MSPSIServer
+from mspsi.points import iter_points, packed_shape, points_form
 
 
 class TestMSPSI(unittest.TestCase):
@@ -42,6 +46,374 @@ class TestMSPSI(unittest.TestCase):
         for i, j in zip(cards, [0, 0, 1]):
             self.assertEqual(i, j)
 
+    def test_repeated_keywords(self):
+        kwds = [['foo'] * 13, ['foo', 'bar', 'foo']]
+        for scalable in (False, True):
+            (secret_server, published) = self.mspsi_server.publish(kwds, scalable=scalable)
+            self.assertEqual(len(published[1]), 3)
+
+            (secret_client, query) = self.mspsi_client.query(['foo', 'bar'])
+            reply = self.mspsi_server.reply(secret_server, query)
+            self.assertEqual(self.mspsi_client.compute_cardinalities(secret_client, reply, published), [1, 2])
+
+    def test_filter_cls(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+
+        (_, published) = self.mspsi_server.publish(kwds)
+        self.assertIsInstance(published[1], HighLoadCuckooFilter)
+        self.assertEqual(published[1].capacity, 2)
+
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=CuckooFilter)
+        self.assertNotIsInstance(published[1], CompactCuckooFilter)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards, [2, 1, 0])
+
+    def test_xor_filter(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=XorFilter, corpus_filter=True)
+
+        self.assertIsInstance(published[1], XorFilter)
+        self.assertIsInstance(published[2], XorFilter)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards, [2, 1, 0])
+
+    def test_corpus_filter(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        self.assertEqual(len(published), 3)
+        self.assertEqual(len(published[2]), 5)
+
+        for query_kwds, expected in ((['foo', ''], [2, 1, 0]), (['asdf', 'ghjk'], [0, 0, 1]), (['ghjk', 'qwer'], [0, 0, 0])):
+            (secret_client, query) = self.mspsi_client.query(query_kwds)
+            reply = self.mspsi_server.reply(secret_server, query)
+            cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+            self.assertEqual(cards, expected)
+
+    def test_scalable(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True, scalable=True)
+
+        self.assertIsInstance(published[1], ScalableCuckooFilter)
+        self.assertIsInstance(published[2], ScalableCuckooFilter)
+        self.assertEqual(published[1].resizes, 0)
+        self.assertEqual(len(published[1]), 6)
+
+        # Keywords beyond the capacity go to a new filter of the chain.
+        published[1].insert_many([bytes(64)] * 20)
+        self.assertGreater(published[1].resizes, 0)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards, [2, 1, 0])
+
+    def test_publish_stream(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] + [['kwd{}'.format(i)] for i in range(200)]
+
+        for n_kwds, processes in ((1000, 1), (2, 1), (len(kwds), 2)):
+            (secret_server, published) = self.mspsi_server.publish_stream(iter(kwds), n_kwds, corpus_filter=True, processes=processes)
+
+            self.assertEqual(published[0], len(kwds))
+            self.assertIsInstance(published[1], ScalableCuckooFilter)
+            self.assertEqual(len(published[1]), 206)
+            self.assertEqual(len(published[2]), 205)
+
+            (secret_client, query) = self.mspsi_client.query(['foo', ''])
+            reply = self.mspsi_server.reply(secret_server, query)
+            cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+            self.assertEqual(cards[:3], [2, 1, 0])
+            self.assertEqual(sum(cards), 3)
+
+            # A chain sized for more keywords does not grow, an undersized one grows.
+            self.assertEqual(published[1].resizes == 0, n_kwds == 1000)
+
+        (_, published) = self.mspsi_server.publish_stream(iter([]), 0)
+        self.assertEqual(published[0], 0)
+
+        with self.assertRaises(ValueError):
+            self.mspsi_server.publish_stream(iter(kwds), len(kwds), filter_cls=XorFilter)
+
+    def test_append(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        new_kwds = [['foo'], ['kwd{}'.format(i) for i in range(50)], ['']]
+
+        for filter_cls in (HighLoadCuckooFilter, XorFilter):
+            (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=filter_cls, corpus_filter=True)
+            published = self.mspsi_server.append(secret_server, published, iter(new_kwds))
+
+            self.assertEqual(published[0], 6)
+            self.assertIsInstance(published[1], ScalableCuckooFilter)
+            self.assertEqual(len(published[1]), 58)
+            self.assertGreater(published[1].resizes, 0)
+
+            for query_kwds, expected in ((['foo', ''], [2, 1, 0, 1, 0, 1]), (['kwd7', 'kwd8'], [0, 0, 0, 0, 2, 0])):
+                (secret_client, query) = self.mspsi_client.query(query_kwds)
+                reply = self.mspsi_server.reply(secret_server, query)
+                cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+                self.assertEqual(cards, expected)
+
+        # The filters added to a chain are of the requested class.
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=CompactCuckooFilter, scalable=True)
+        published = self.mspsi_server.append(secret_server, published, [['kwd{}'.format(i)] for i in range(100)], filter_cls=HighLoadCuckooFilter)
+
+        self.assertGreater(published[1].resizes, 0)
+        self.assertEqual({type(f) for f in published[1].filters[1:]}, {HighLoadCuckooFilter})
+
+        (secret_client, query) = self.mspsi_client.query(['foo', 'kwd7'])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards[:3] + cards[10:11], [1, 1, 0, 1])
+        self.assertEqual(sum(cards), 3)
+
+    def test_append_corpus(self):
+        (secret_server, published) = self.mspsi_server.publish([['the']] * 64, corpus_filter=True)
+        for _ in range(40):
+            published = self.mspsi_server.append(secret_server, published, [['the']] * 64)
+
+        # Keywords already in the corpus-wide filter are not inserted again.
+        self.assertEqual(len(published[2]), 1)
+        self.assertEqual(published[2].resizes, 0)
+
+        (_, published) = self.mspsi_server.publish([['a', 'b']] * 10, filter_cls=XorFilter)
+        published = self.mspsi_server.append(secret_server, published, [['c']])
+        self.assertEqual(MSPSIServer.published_len(published), sum(f.capacity * f.bucket_size for f in published[1].filters))
+        self.assertEqual(published[1].load_factor, 21 / MSPSIServer.published_len(published))
+
+    def test_unpublish(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, scalable=True)
+
+        self.assertEqual(self.mspsi_server.unpublish(secret_server, published, 0, kwds[0]), 3)
+        self.assertEqual(len(published[1]), 3)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        # The doc id of the withdrawn document is kept as a tombstone.
+        self.assertEqual(cards, [0, 1, 0])
+        self.assertEqual(published.withdrawn, {0})
+
+        with self.assertRaises(ValueError):
+            self.mspsi_server.unpublish(secret_server, published, 3, ['foo'])
+        with self.assertRaises(ValueError):
+            self.mspsi_server.unpublish(secret_server, published, 0, kwds[0])
+
+        # Tombstones are held by the publication and kept by appends.
+        appended = self.mspsi_server.append(secret_server, published, [['foo']])
+        self.assertEqual(appended.withdrawn, {0})
+        self.assertIsNot(appended.withdrawn, published.withdrawn)
+        with self.assertRaises(ValueError):
+            self.mspsi_server.unpublish(secret_server, tuple(appended), 1, kwds[1])
+
+        # Static filters cannot delete the keywords of a document, which is then not withdrawn.
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=XorFilter)
+        with self.assertRaises(ValueError):
+            self.mspsi_server.unpublish(secret_server, published, 0, kwds[0])
+        published = self.mspsi_server.append(secret_server, published, [['foo']])
+        with self.assertRaises(ValueError):
+            self.mspsi_server.unpublish(secret_server, published, 1, kwds[1])
+        self.assertEqual(self.mspsi_server.unpublish(secret_server, published, 3, ['foo']), 1)
+        self.assertEqual(published.withdrawn, {3})
+
+        reply = self.mspsi_server.reply(secret_server, query)
+        self.assertEqual(self.mspsi_client.compute_cardinalities(secret_client, reply, published), [2, 1, 0, 0])
+        self.assertEqual(self.mspsi_client.compute_cardinalities_threshold(secret_client, reply, published, 1), {0: 2, 1: 1})
+        self.assertEqual(self.mspsi_client.compute_cardinalities_top_k(secret_client, reply, published, 1), {0: 2})
+
+    def test_publish_processes(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] * 50
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True, processes=2)
+
+        self.assertEqual(published[0], 150)
+        self.assertEqual(len(published[1]), 300)
+        self.assertEqual(len(published[2]), 5)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards, [2, 1, 0] * 50)
+
+    def test_cardinalities_processes(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] * 1000
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published, processes=2)
+
+        self.assertEqual(cards, [2, 1, 0] * 1000)
+
+    def test_pool(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] * 1000
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+        client = MSPSIClient(415)
+
+        client.open_pool(published, 2)
+        with self.assertRaises(ValueError):
+            client.open_pool(published, 2)
+
+        # The same pool serves every computation on the publication.
+        for query_kwds, expected in ((['foo', ''], [2, 1, 0]), (['asdf'], [0, 0, 1])):
+            (secret_client, query) = client.query(query_kwds)
+            reply = self.mspsi_server.reply(secret_server, query)
+            self.assertEqual(client.compute_cardinalities(secret_client, reply, published), expected * 1000)
+
+        queries = [client.query(query_kwds) for query_kwds in (['foo'], ['baz', 'bar'])]
+        replies = [self.mspsi_server.reply(secret_server, query) for _, query in queries]
+        cards = client.compute_cardinalities_many([secret for secret, _ in queries], replies, published)
+        self.assertEqual(cards, [[1, 1, 0] * 1000, [1, 1, 0] * 1000])
+
+        client.close_pool(published)
+        self.assertEqual(client.pools, {})
+        with self.assertRaises(ValueError):
+            client.close_pool(published)
+
+    def test_reply_many(self):
+        (secret_server, _) = self.mspsi_server.publish([['foo']])
+        queries = [self.mspsi_client.query(kwds)[1] for kwds in (['foo', 'bar'], [], ['baz', 'foo', 'bar'])]
+        queries.append(queries[0])
+        expected = [self.mspsi_server.reply(secret_server, query) for query in queries]
+
+        self.assertEqual(self.mspsi_server.reply_many(secret_server, queries), expected)
+
+        for executor_cls in (ThreadPoolExecutor, ProcessPoolExecutor):
+            with executor_cls(2) as executor:
+                self.assertEqual(self.mspsi_server.reply_many(secret_server, queries, executor), expected)
+
+    def test_packed(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+
+        (secret_client, query) = self.mspsi_client.query(['foo', '', 'ghjk'], packed=True)
+        self.assertEqual(packed_shape(query), (POINT_CONVERSION_COMPRESSED, 33, 3))
+
+        reply = self.mspsi_server.reply(secret_server, memoryview(query))
+        self.assertEqual(packed_shape(reply), (POINT_CONVERSION_COMPRESSED, 33, 3))
+        self.assertEqual(list(iter_points(reply)), self.mspsi_server.reply(secret_server, list(iter_points(query))))
+
+        cards = self.mspsi_client.compute_cardinalities(secret_client, bytes(reply), published)
+        self.assertEqual(cards, [2, 1, 0])
+
+        replies = self.mspsi_server.reply_many(secret_server, [query, list(iter_points(query))])
+        self.assertEqual(replies, [reply, list(iter_points(reply))])
+
+        with self.assertRaises(ValueError):
+            self.mspsi_server.reply(secret_server, query[:-1])
+
+    def test_point_form(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+        client = MSPSIClient(415, point_form=POINT_CONVERSION_UNCOMPRESSED)
+
+        for packed in (False, True):
+            (secret_client, query) = client.query(['foo', '', 'ghjk'], packed=packed)
+            self.assertEqual(points_form(query), POINT_CONVERSION_UNCOMPRESSED)
+            self.assertEqual({len(pt) for pt in iter_points(query)}, {65})
+
+            reply = self.mspsi_server.reply(secret_server, query)
+            self.assertEqual(points_form(reply), POINT_CONVERSION_UNCOMPRESSED)
+            self.assertEqual(client.compute_cardinalities(secret_client, reply, published), [2, 1, 0])
+
+            (reply_many,) = self.mspsi_server.reply_many(secret_server, [query])
+            self.assertEqual(reply_many, reply)
+
+        # A server may enforce the form of its replies.
+        server = MSPSIServer(415, point_form=POINT_CONVERSION_COMPRESSED)
+        (secret_server, published) = server.publish(kwds)
+        (secret_client, query) = client.query(['foo', '', 'ghjk'], packed=True)
+        reply = server.reply(secret_server, query)
+        self.assertEqual(packed_shape(reply), (POINT_CONVERSION_COMPRESSED, 33, 3))
+        self.assertEqual(client.compute_cardinalities(secret_client, reply, published), [2, 1, 0])
+
+        with self.assertRaises(ValueError):
+            MSPSIClient(415, point_form=3)
+
+    def test_reply_all(self):
+        server = MSPSIServer(415)
+        kwds = ([['foo', 'bar', ''], ['foo', 'baz'], ['asdf']], [['bar'], ['foo', '']])
+        publications = dict()
+        for publication_id, docs in zip(('a', 'b'), kwds):
+            (secret_server, published) = server.publish(docs)
+            server.register(publication_id, secret_server)
+            publications[publication_id] = (secret_server, published)
+
+        for packed in (False, True):
+            (secret_client, query) = self.mspsi_client.query(['foo', ''], packed=packed)
+            replies = server.reply_all(query)
+
+            self.assertEqual(list(replies), ['a', 'b'])
+            for publication_id, (secret_server, published) in publications.items():
+                self.assertEqual(replies[publication_id], server.reply(secret_server, query))
+
+            cards = {publication_id: self.mspsi_client.compute_cardinalities(secret_client, reply, publications[publication_id][1]) for publication_id, reply in replies.items()}
+            self.assertEqual(cards, {'a': [2, 1, 0], 'b': [0, 2]})
+
+        with self.assertRaises(ValueError):
+            server.register('a', publications['a'][0])
+
+        server.unregister('a')
+        self.assertEqual(list(server.reply_all(query)), ['b'])
+
+        with self.assertRaises(ValueError):
+            server.unregister('a')
+
+    @staticmethod
+    def sparse_docs():
+        rng = random.Random(0)
+        vocabulary = ['kwd{}'.format(i) for i in range(10)]
+        return (vocabulary, [rng.sample(vocabulary, rng.randint(0, 5)) for _ in range(1500)])
+
+    def test_cardinalities_sparse(self):
+        (vocabulary, kwds) = self.sparse_docs()
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+
+        (secret_client, query) = self.mspsi_client.query(vocabulary[:4])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        for threshold in (1, 3, 4):
+            expected = {doc_id: card for doc_id, card in enumerate(cards) if card >= threshold}
+            self.assertEqual(self.mspsi_client.compute_cardinalities_threshold(secret_client, reply, published, threshold), expected)
+
+        for k in (1, 10, 2000):
+            expected = sorted(((-card, doc_id) for doc_id, card in enumerate(cards) if card > 0))[:k]
+            top_k = self.mspsi_client.compute_cardinalities_top_k(secret_client, reply, published, k)
+            self.assertEqual(list(top_k.items()), [(doc_id, -card) for card, doc_id in expected])
+
+        with self.assertRaises(ValueError):
+            self.mspsi_client.compute_cardinalities_threshold(secret_client, reply, published, 0)
+
+    def test_cardinalities_many(self):
+        (vocabulary, kwds) = self.sparse_docs()
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        secrets, replies, expected = list(), list(), list()
+        for query_kwds in (vocabulary[:4], vocabulary[2:6], ['ghjk'], []):
+            (secret_client, query) = self.mspsi_client.query(query_kwds)
+            secrets.append(secret_client)
+            replies.append(self.mspsi_server.reply(secret_server, query))
+            # The cardinalities are computed on the keywords in the clear.
+            expected.append([len(set(query_kwds) & set(doc)) for doc in kwds])
+
+        for processes in (1, 2):
+            self.assertEqual(self.mspsi_client.compute_cardinalities_many(secrets, replies, published, processes), expected)
+
     def test_false_positives(self):
         # Random data generation with keywords known to be inside the corpus
         random.seed(0)
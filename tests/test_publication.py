@@ -0,0 +1,156 @@
+import io
+import os
+import tempfile
+import unittest
+
+from cuckoopy_mod import CompactCuckooFilter, CuckooFilter, HighLoadCuckooFilter, ScalableCuckooFilter, SemiSortedTable, XorFilter
+from mspsi import publication
+from mspsi.mspsi import MSPSIClient, MSPSIServer
+
+
+class TestPublication(unittest.TestCase):
+    def __init__(self, tests):
+        curve = 415
+        self.mspsi_client = MSPSIClient(curve)
+        self.mspsi_server = MSPSIServer(curve)
+        super().__init__(tests)
+
+    def check_cardinalities(self, secret_server, published):
+        (secret_client, query) = self.mspsi_client.query(['foo', ''])
+        reply = self.mspsi_server.reply(secret_server, query)
+        cards = self.mspsi_client.compute_cardinalities(secret_client, reply, published)
+
+        self.assertEqual(cards[:3], [2, 1, 0])
+
+    def test_roundtrip(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        for compress in (False, True):
+            data = publication.dumps(published, compress=compress)
+            loaded = publication.loads(data)
+
+            self.assertEqual(len(data) % publication.FORMAT_ALIGNMENT, 0)
+            self.assertEqual(loaded[0], 3)
+            self.assertEqual(len(loaded), 3)
+            for published_data, loaded_data in zip(published[1:], loaded[1:]):
+                self.assertEqual(len(loaded_data), len(published_data))
+                self.assertTrue((loaded_data.table == published_data.table).all())
+
+            self.check_cardinalities(secret_server, loaded)
+            self.assertIsInstance(loaded[1], HighLoadCuckooFilter)
+
+        # Mostly empty filters compress well.
+        (_, published) = self.mspsi_server.publish(kwds, filter_cls=CompactCuckooFilter)
+        self.assertLess(len(publication.dumps(published, compress=True)), len(publication.dumps(published)))
+
+    def test_stream(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=CuckooFilter)
+
+        fd = io.BytesIO()
+        publication.dump(published, fd)
+        fd.seek(0)
+        loaded = publication.load(fd)
+
+        self.assertIsInstance(loaded[1], CompactCuckooFilter)
+        self.check_cardinalities(secret_server, loaded)
+
+        # Loaded filters remain writable.
+        loaded[1].insert(bytes(64))
+
+    def test_mapped(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, corpus_filter=True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                publication.dump(published, fd)
+
+            mapped = publication.load_mapped(path)
+
+            self.assertEqual(len(mapped), 3)
+            self.assertFalse(mapped[1].table.flags.writeable)
+            self.check_cardinalities(secret_server, mapped)
+            with self.assertRaises(ValueError):
+                mapped[1].insert(bytes(64))
+
+            # Appending is refused before any filter is touched.
+            sizes = [len(f) for f in mapped[1:]]
+            with self.assertRaises(ValueError):
+                self.mspsi_server.append(secret_server, mapped, [['foo', 'qux']])
+            self.assertEqual([len(f) for f in mapped[1:]], sizes)
+            self.assertNotIsInstance(mapped[1], ScalableCuckooFilter)
+            self.check_cardinalities(secret_server, mapped)
+
+            with open(path, 'wb') as fd:
+                publication.dump(published, fd, compress=True)
+
+            with self.assertRaises(ValueError):
+                publication.load_mapped(path)
+
+    def test_semi_sorted(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']] + [['kwd{}_{}'.format(i, j) for j in range(50)] for i in range(20)]
+        (secret_server, published) = self.mspsi_server.publish(kwds)
+
+        data = publication.dumps(published, semi_sorted=True)
+        loaded = publication.loads(data)
+
+        self.assertIsInstance(loaded[1].table, SemiSortedTable)
+        self.assertLess(len(data), len(publication.dumps(published)))
+        self.check_cardinalities(secret_server, loaded)
+
+        with self.assertRaises(ValueError):
+            self.mspsi_server.append(secret_server, loaded, [['foo', 'qux']])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                fd.write(data)
+
+            self.check_cardinalities(secret_server, publication.load_mapped(path))
+
+    def test_xor_filter(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, filter_cls=XorFilter)
+
+        loaded = publication.loads(publication.dumps(published))
+
+        self.assertIsInstance(loaded[1], XorFilter)
+        self.assertEqual(loaded[1].seed, published[1].seed)
+        self.check_cardinalities(secret_server, loaded)
+
+    def test_scalable(self):
+        kwds = [['foo', 'bar', ''], ['foo', 'baz'], ['asdf']]
+        (secret_server, published) = self.mspsi_server.publish(kwds, scalable=True)
+        published[1].insert_many([os.urandom(64) for _ in range(100)])
+
+        loaded = publication.loads(publication.dumps(published, compress=True))
+
+        self.assertIsInstance(loaded[1], ScalableCuckooFilter)
+        self.assertEqual(loaded[1].resizes, published[1].resizes)
+        self.assertEqual(len(loaded[1]), len(published[1]))
+        self.check_cardinalities(secret_server, loaded)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'publication')
+            with open(path, 'wb') as fd:
+                publication.dump(published, fd, semi_sorted=True)
+
+            self.check_cardinalities(secret_server, publication.load_mapped(path))
+
+    def test_errors(self):
+        (_, published) = self.mspsi_server.publish([['foo']])
+        data = publication.dumps(published)
+
+        with self.assertRaises(ValueError):
+            publication.loads(b'ABCD' + data[4:])
+        with self.assertRaises(ValueError):
+            publication.loads(data, curve=714)
+        with self.assertRaises(ValueError):
+            publication.loads(data[:-8])
+
+
+if __name__ == '__main__':
+    unittest.main()